@@ -0,0 +1,240 @@
+"""
+Benchmark harness for the zonal statistics pipeline.
+
+Generates synthetic USGS-like tiles and TIGER-like polygons (see
+``synthetic_data.py``) at several scales, then for each scale:
+
+- times the stages of the mosaic path separately per polygon: tile
+  lookup, window read, masking, reduction and output;
+- runs every strategy end to end through ``run_zonal_stats``;
+
+and reports polygons/sec, MB decoded and read from disk, and peak RSS.
+Each scenario runs in its own process, so peak RSS is its own. Results
+are compared with ``benchmarks/baseline.json`` when it exists::
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --scales small --write-baseline
+
+Everything runs offline; generated data is kept in ``benchmarks/data``.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+
+from checkpoint_store import CheckpointStore  # noqa: E402
+from mosaic import DatasetPool  # noqa: E402
+from polygon_dataset import iter_partitions  # noqa: E402
+from synthetic_data import generate_polygons, generate_tiles  # noqa: E402
+from tile_catalog import TileCatalog  # noqa: E402
+from zonal_engine import MOSAIC, STRATEGIES, RunOptions, compute_stats, run_zonal_stats  # noqa: E402
+
+BASELINE_PATH = os.path.join(benchmarks_dir, "baseline.json")
+DATA_DIR = os.path.join(benchmarks_dir, "data")
+
+# Benchmark scales: tiles per side and number of polygons
+SCALES = {
+    "small": {"tiles": 2, "polygons": 200},
+    "medium": {"tiles": 3, "polygons": 1000},
+    "large": {"tiles": 4, "polygons": 4000},
+}
+
+# Name of the scenario that times the mosaic path stage by stage
+STAGES = "stages"
+
+# Origin (lon, lat) of the south-west synthetic tile
+ORIGIN = (-105, 40)
+
+
+# Function to read the bytes this process has read through read() so far (Linux only)
+def _bytes_read():
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+# Function to read the peak resident set size of this process in MB
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == "darwin" else peak / 2 ** 10
+
+
+def prepare_data(scale, pixels_per_degree, data_dir=DATA_DIR):
+    """Generate (or reuse) the tiles and polygons of one scale; returns their paths."""
+    settings = SCALES[scale]
+    tiles = settings["tiles"]
+    elevation_dir = os.path.join(data_dir, f"tiles_{pixels_per_degree}_{tiles}x{tiles}")
+    generate_tiles(elevation_dir, ORIGIN, tiles, tiles, pixels_per_degree)
+    bounds = (ORIGIN[0], ORIGIN[1], ORIGIN[0] + tiles, ORIGIN[1] + tiles)
+    polygons_path = os.path.join(data_dir, f"polygons_{scale}.parquet")
+    # One vertex per arc-second (about 30 m) of boundary, similar to TIGER layers
+    generate_polygons(polygons_path, bounds, settings["polygons"], vertex_spacing=1 / 3600)
+    return elevation_dir, polygons_path
+
+
+def _load_features(polygons_path):
+    features = []
+    for polygons in iter_partitions(polygons_path, columns=["GEOID"]):
+        features.extend(zip(polygons["GEOID"], polygons.geometry))
+    return features
+
+
+# Function to time the mosaic path one stage at a time in this process
+def _run_stages(features, catalog, store, output_path):
+    timings = defaultdict(float)
+    datasets = DatasetPool()
+    try:
+        for feature_id, geometry in features:
+            start = time.perf_counter()
+            tiles = catalog.query_tiles(geometry.bounds)
+            timings["lookup"] += time.perf_counter() - start
+            if not tiles:
+                continue
+            stats = compute_stats(geometry, tiles, MOSAIC, datasets, timings)
+            start = time.perf_counter()
+            store.put(feature_id, stats)
+            timings["output"] += time.perf_counter() - start
+    finally:
+        datasets.close()
+    start = time.perf_counter()
+    store.export(output_path, "GEOID")
+    timings["output"] += time.perf_counter() - start
+    decoded = timings.pop("bytes_read")
+    return dict(timings), decoded
+
+
+def run_scenario(elevation_dir, polygons_path, strategy):
+    """Run one scenario in the current process and return its measurements."""
+    features = _load_features(polygons_path)
+    bytes_before = _bytes_read()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        # Build the catalog from scratch, as on a first run
+        start = time.perf_counter()
+        catalog = TileCatalog.load(elevation_dir, cache_path=os.path.join(tmp_dir, "catalog.json"))
+        catalog_seconds = time.perf_counter() - start
+
+        output_path = os.path.join(tmp_dir, "output.csv")
+        with CheckpointStore(os.path.join(tmp_dir, "output.sqlite")) as store:
+            start = time.perf_counter()
+            if strategy == STAGES:
+                stages, decoded = _run_stages(features, catalog, store, output_path)
+            else:
+                run_zonal_stats(features, catalog, store.put, RunOptions(strategy=strategy, workers=1))
+                store.export(output_path, "GEOID")
+                stages, decoded = None, None
+            seconds = time.perf_counter() - start
+
+    bytes_after = _bytes_read()
+    result = {
+        "polygons": len(features),
+        "seconds": seconds,
+        "polygons_per_sec": len(features) / seconds,
+        "catalog_seconds": catalog_seconds,
+        "mb_read": (bytes_after - bytes_before) / 1e6 if bytes_before is not None else None,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    if stages is not None:
+        result["stage_seconds"] = stages
+        result["mb_decoded"] = decoded / 1e6
+    return result
+
+
+def run_benchmarks(scales, strategies, pixels_per_degree):
+    """Run every (scale, strategy) scenario in a fresh process. Returns ``{"scale/strategy": result}``."""
+    results = {}
+    context = multiprocessing.get_context("spawn")
+    for scale in scales:
+        elevation_dir, polygons_path = prepare_data(scale, pixels_per_degree)
+        for strategy in strategies:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                result = executor.submit(run_scenario, elevation_dir, polygons_path, strategy).result()
+            results[f"{scale}/{strategy}"] = result
+            print(format_result(f"{scale}/{strategy}", result))
+    return results
+
+
+def format_result(name, result):
+    line = (f"{name:<22} {result['polygons']:>6} polygons  {result['polygons_per_sec']:>9.1f} polygons/sec  "
+            f"peak RSS {result['peak_rss_mb']:>7.1f} MB")
+    if result["mb_read"] is not None:
+        line += f"  read {result['mb_read']:>8.1f} MB"
+    if "stage_seconds" in result:
+        stages = ", ".join(f"{stage} {seconds:.2f}s" for stage, seconds in result["stage_seconds"].items())
+        line += f"\n{'':<22} {stages}; {result['mb_decoded']:.1f} MB decoded"
+    return line
+
+
+def compare(results, baseline):
+    """Print the change in polygons/sec and peak RSS of every scenario that is in the baseline."""
+    print(f"\nCompared with the baseline from {baseline['machine']['recorded']} "
+          f"({baseline['machine']['platform']}, {baseline['machine']['cpus']} CPUs):")
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if before is None:
+            print(f"{name:<22} not in baseline")
+            continue
+        speed = result["polygons_per_sec"] / before["polygons_per_sec"] - 1
+        rss = result["peak_rss_mb"] / before["peak_rss_mb"] - 1
+        print(f"{name:<22} polygons/sec {speed:+7.1%}  peak RSS {rss:+7.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the zonal statistics pipeline on synthetic data.")
+    parser.add_argument("--scales", nargs="+", choices=SCALES, default=list(SCALES))
+    parser.add_argument("--strategies", nargs="+", choices=(STAGES,) + STRATEGIES, default=[STAGES, *STRATEGIES])
+    parser.add_argument("--pixels-per-degree", type=int, default=1200,
+                        help="Tile resolution (default: 1200; the USGS 1/3 arc-second tiles have 10800)")
+    parser.add_argument("--output", help="Also write the results to this JSON file")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="Baseline JSON to compare with")
+    parser.add_argument("--write-baseline", action="store_true", help="Save the results as the new baseline")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scales, args.strategies, args.pixels_per_degree)
+    report = {
+        "machine": {
+            "recorded": time.strftime("%Y-%m-%d"),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "pixels_per_degree": args.pixels_per_degree,
+        "results": results,
+    }
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("pixels_per_degree") == args.pixels_per_degree:
+            compare(results, baseline)
+        else:
+            print(f"\nBaseline was recorded at {baseline.get('pixels_per_degree')} pixels per degree; not comparing")
+    else:
+        print(f"\nNo baseline at {args.baseline}; run with --write-baseline to record one")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.write_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"Baseline written to {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Synthetic inputs for the benchmarks: elevation tiles laid out like the
+USGS ``USGS_13_*`` files and TIGER-like polygon coverages, generated
+deterministically from a seed so every run measures the same data.
+"""
+import os
+
+import geopandas as gpd
+import numpy as np
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+
+# USGS 1-degree tiles overlap their neighbours by 6 pixels on every side
+OVERLAP = 6
+NODATA = -999999.0
+CRS = "EPSG:4269"
+
+
+# Function to name a tile by its top-left corner, as the USGS files are
+def tile_name(lon, lat):
+    return f"USGS_13_n{lat + 1:02d}w{-lon:03d}.tif"
+
+
+# Function to compute a smooth, hilly elevation surface at pixel centres
+def _elevation(lons, lats, rng_phase):
+    return (1500
+            + 400 * np.sin(lons * 7 + rng_phase[0]) * np.cos(lats * 5 + rng_phase[1])
+            + 120 * np.sin(lons * 41 + lats * 37 + rng_phase[2])
+            + 30 * np.cos(lons * 173 - lats * 151 + rng_phase[3])).astype(np.float32)
+
+
+def generate_tiles(directory, origin=(-105, 40), tiles_x=2, tiles_y=2, pixels_per_degree=1200, seed=0):
+    """
+    Write ``tiles_x`` by ``tiles_y`` one-degree float32 GeoTIFF tiles into
+    ``directory``, starting at the south-west corner ``origin`` (lon, lat).
+    Like the USGS tiles they are in NAD83, tiled and LZW-compressed, overlap
+    their neighbours by 6 pixels and mark missing data with -999999 (a
+    coastal band along the south edge of the southernmost row). Existing
+    tiles are kept. Returns the tile paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    phase = rng.uniform(0, 2 * np.pi, 4)
+    res = 1.0 / pixels_per_degree
+    size = pixels_per_degree + 2 * OVERLAP
+    paths = []
+    for lat in range(origin[1], origin[1] + tiles_y):
+        for lon in range(origin[0], origin[0] + tiles_x):
+            path = os.path.join(directory, tile_name(lon, lat))
+            paths.append(path)
+            if os.path.exists(path):
+                continue
+            transform = from_origin(lon - OVERLAP * res, lat + 1 + OVERLAP * res, res, res)
+            lons = transform.c + (np.arange(size) + 0.5) * res
+            lats = transform.f - (np.arange(size) + 0.5) * res
+            data = _elevation(lons[None, :], lats[:, None], phase)
+            if lat == origin[1]:
+                data[-size // 20:, :] = NODATA
+            tmp_path = path + ".tmp"
+            with rasterio.open(tmp_path, "w", driver="GTiff", width=size, height=size, count=1, dtype="float32",
+                               crs=CRS, transform=transform, nodata=NODATA, tiled=True, blockxsize=256,
+                               blockysize=256, compress="lzw") as dst:
+                dst.write(data, 1)
+            os.replace(tmp_path, path)
+    return paths
+
+
+def generate_polygons(path, bounds, count, vertex_spacing, seed=0):
+    """
+    Write a GeoParquet layer of ``count`` polygons that tile ``bounds`` like
+    a TIGER coverage (Voronoi cells, no overlaps) with wiggly boundaries of
+    one vertex every ``vertex_spacing`` degrees, mimicking the vertex density
+    of TIGER boundaries. IDs look like tract GEOIDs. Returns the path.
+    """
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    left, bottom, right, top = bounds
+    extent = shapely.box(left, bottom, right, top)
+    points = shapely.multipoints(np.column_stack([rng.uniform(left, right, count), rng.uniform(bottom, top, count)]))
+    cells = shapely.get_parts(shapely.voronoi_polygons(points, extend_to=extent))
+    cells = shapely.intersection(cells, extent)
+    cells = shapely.segmentize(cells, vertex_spacing)
+
+    # Displace every vertex by a function of its position, so the edges two
+    # cells share stay identical and the layer remains a coverage
+    amplitude = vertex_spacing * 0.4
+
+    def wiggle(coords):
+        x, y = coords[:, 0], coords[:, 1]
+        on_edge = np.isclose(x, left) | np.isclose(x, right) | np.isclose(y, bottom) | np.isclose(y, top)
+        offset = amplitude * np.sin(x * 7919 + y * 104729) * ~on_edge
+        return np.column_stack([x + offset, y - offset])
+
+    cells = shapely.make_valid(shapely.transform(cells, wiggle))
+    geoids = [f"08{i // 1000:03d}{i % 1000:06d}" for i in range(len(cells))]
+    polygons = gpd.GeoDataFrame({"GEOID": geoids}, geometry=cells, crs=CRS)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    polygons.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    return path
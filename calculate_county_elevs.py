@@ -1,49 +1,77 @@
+import os
+
 import pandas as pd
 import geopandas as gpd
 
-# File paths (modify these as needed)
-tract_elevations_file = "tract_elevations.csv"
-population_data_file = "census_population.csv"
-tracts_shapefile = "tl_2024_us_tract.shp"
+from rollup import PIXEL_SUM_COLUMNS, pixel_rollup, weighted_rollup
+from table_io import first_existing, read_table, table_columns, write_table
+
+# File paths (modify these as needed). Inputs are read from Parquet when a
+# Parquet version exists; set output_format to "parquet" for Parquet outputs.
+tract_elevations_file = first_existing("tract_elevations.parquet", "tract_elevations.csv")
+population_data_file = first_existing("census_population.parquet", "census_population.csv")
 counties_shapefile = "tl_2024_us_county.shp"
-output_csv = "county_weighted_elevations.csv"
+output_format = "csv"
+output_csv = f"county_weighted_elevations.{output_format}"
+state_output_csv = f"state_weighted_elevations.{output_format}"
+national_output_csv = f"national_weighted_elevation.{output_format}"
 
-# Load tract elevation data
-tract_elevations = pd.read_csv(tract_elevations_file, dtype={"Tract ID": str})
+# Load tract elevation data, only the columns used below
+tract_columns = ["Tract ID", "Average Elevation"]
+tract_columns += [c for c in PIXEL_SUM_COLUMNS if c in table_columns(tract_elevations_file)]
+tract_elevations = read_table(tract_elevations_file, columns=tract_columns, id_columns=["Tract ID"])
 tract_elevations.rename(columns={"Tract ID": "GEOID", "Average Elevation": "Elevation"}, inplace=True)
 
 # Load population data
-population_data = pd.read_csv(population_data_file, dtype={"GEOID": str})
+population_data = read_table(population_data_file, columns=["GEOID", "Total_Population"], id_columns=["GEOID"])
 
 # Merge elevation and population data
 merged_data = pd.merge(tract_elevations, population_data, on="GEOID", how="left")
 
-# Handle missing population values by filling them with the median population
+# Handle missing population values by filling them with the median population. Parquet
+# populations are nullable integers, which cannot hold a fractional median.
+merged_data["Total_Population"] = merged_data["Total_Population"].astype("float64")
 median_population = merged_data["Total_Population"].median()
-merged_data["Total_Population"].fillna(median_population, inplace=True)
-
-# Load census tract shapefile (keeping only relevant columns)
-tracts = gpd.read_file(tracts_shapefile)[["GEOID", "COUNTYFP", "STATEFP"]]
-
-# Create full County FIPS by combining State FIPS and County FIPS
-tracts["County_FIPS"] = tracts["STATEFP"] + tracts["COUNTYFP"]
+merged_data["Total_Population"] = merged_data["Total_Population"].fillna(median_population)
 
-# Load county shapefile to get county names
-counties = gpd.read_file(counties_shapefile)[["STATEFP", "COUNTYFP", "NAME"]]
-counties["County_FIPS"] = counties["STATEFP"] + counties["COUNTYFP"]
+# Compute population-weighted average elevation for every county, state and the nation.
+# County and state FIPS are prefixes of the tract GEOID, so no tract shapefile is needed.
+levels = weighted_rollup(merged_data, "GEOID", "Elevation", "Total_Population")
 
-# Merge county information into the tract data
-merged_data = pd.merge(merged_data, tracts[["GEOID", "County_FIPS"]], on="GEOID", how="left")
+weighted_elevations = levels["county"].rename(columns={"key": "County_FIPS", "value": "Weighted_Avg_Elevation"})
+state_elevations = levels["state"].rename(
+    columns={"key": "State_FIPS", "value": "Weighted_Avg_Elevation", "weight": "Total_Population"})
+national_elevation = levels["nation"].rename(
+    columns={"key": "Country", "value": "Weighted_Avg_Elevation", "weight": "Total_Population"})
 
-# Compute population-weighted average elevation for each county
-weighted_elevations = merged_data.groupby("County_FIPS").apply(
-    lambda x: (x["Elevation"] * x["Total_Population"]).sum() / x["Total_Population"].sum()
-).reset_index(name="Weighted_Avg_Elevation")
+# When the tract output carries pixel partial sums, add exact pixel-level and
+# area-weighted elevations, combined from the sums rather than from tract averages
+if all(column in tract_elevations.columns for column in PIXEL_SUM_COLUMNS):
+    pixel_levels = pixel_rollup(tract_elevations, "GEOID")
+    pixel_columns = ["key", "Pixel_Mean_Elevation", "Area_Weighted_Elevation", "Area_m2"]
+    weighted_elevations = pd.merge(weighted_elevations, pixel_levels["county"][pixel_columns].rename(
+        columns={"key": "County_FIPS"}), on="County_FIPS", how="left")
+    state_elevations = pd.merge(state_elevations, pixel_levels["state"][pixel_columns].rename(
+        columns={"key": "State_FIPS"}), on="State_FIPS", how="left")
+    national_elevation = pd.merge(national_elevation, pixel_levels["nation"][pixel_columns].rename(
+        columns={"key": "Country"}), on="Country", how="left")
 
-# Merge with county names
-final_results = pd.merge(weighted_elevations, counties[["County_FIPS", "NAME"]], on="County_FIPS", how="left")
+# Merge with county names, reading only the attribute table of the county shapefile
+if os.path.exists(counties_shapefile):
+    counties = gpd.read_file(counties_shapefile, columns=["STATEFP", "COUNTYFP", "NAME"], ignore_geometry=True)
+    counties["County_FIPS"] = counties["STATEFP"] + counties["COUNTYFP"]
+else:
+    counties = pd.DataFrame(columns=["County_FIPS", "NAME"])
+final_results = pd.merge(weighted_elevations.drop(columns="weight"),
+                         counties[["County_FIPS", "NAME"]], on="County_FIPS", how="left")
+leading_columns = ["County_FIPS", "Weighted_Avg_Elevation", "NAME"]
+final_results = final_results[leading_columns + [c for c in final_results.columns if c not in leading_columns]]
 
-# Save to CSV
-final_results.to_csv(output_csv, index=False)
+# Save the results
+write_table(final_results, output_csv)
+write_table(state_elevations, state_output_csv)
+write_table(national_elevation, national_output_csv)
 
 print(f"Weighted county elevations saved to {output_csv}")
+print(f"Weighted state elevations saved to {state_output_csv}")
+print(f"Weighted national elevation saved to {national_output_csv}")
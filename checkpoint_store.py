@@ -0,0 +1,321 @@
+import csv
+import itertools
+import json
+import math
+import os
+import sqlite3
+import time
+
+import pyarrow as pa
+
+from elevation_stats import ElevationStats
+from table_io import ROW_GROUP_SIZE, ParquetBatchWriter, is_parquet
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    id TEXT PRIMARY KEY,
+    mean REAL,
+    count INTEGER,
+    total REAL,
+    total_sq REAL,
+    minimum REAL,
+    maximum REAL,
+    area REAL,
+    area_total REAL,
+    extra TEXT
+)
+"""
+
+# Dependency map: the tiles (and their versions) each result was computed from,
+# and the tile set the store was last brought up to date with
+DEPENDENCY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS tiles (
+    id TEXT,
+    tile TEXT,
+    version TEXT,
+    PRIMARY KEY (id, tile)
+);
+CREATE INDEX IF NOT EXISTS tiles_by_tile ON tiles (tile, version);
+CREATE TABLE IF NOT EXISTS tile_set (
+    tile TEXT PRIMARY KEY,
+    version TEXT
+);
+"""
+
+# Columns of the results table, in the order ``put`` records them. ``extra`` holds
+# the statistics of a ``StatisticSet`` that need the pixels, as a JSON object.
+RESULT_COLUMNS = ["id", "mean", "count", "total", "total_sq", "minimum", "maximum", "area", "area_total", "extra"]
+
+# Columns added after the first version of the schema
+ADDED_COLUMNS = {"area": "REAL", "area_total": "REAL", "extra": "TEXT"}
+
+# Result columns an ``ElevationStats`` is rebuilt from, in constructor order
+STATS_COLUMNS = ["count", "total", "total_sq", "minimum", "maximum", "area", "area_total"]
+
+# Output CSV headers and the result columns they are exported from
+CSV_COLUMNS = [
+    ("Average Elevation", "mean"),
+    ("Pixel Count", "count"),
+    ("Elevation Sum", "total"),
+    ("Elevation Sum Squares", "total_sq"),
+    ("Area m2", "area"),
+    ("Area Elevation Sum", "area_total"),
+]
+
+# Parquet types of the exported result columns
+PARQUET_TYPES = {
+    "mean": pa.float64(),
+    "count": pa.int64(),
+    "total": pa.float64(),
+    "total_sq": pa.float64(),
+    "area": pa.float64(),
+    "area_total": pa.float64(),
+}
+
+
+class CheckpointStore:
+    """
+    Journaled store of finished polygons, backed by SQLite in WAL mode.
+
+    Results are buffered and committed in batches (every ``batch_size`` rows or
+    ``batch_seconds`` seconds). A commit is durable once it returns, so a crash
+    or power loss loses at most the last uncommitted batch and never leaves a
+    half-written row. Rows are keyed on the polygon ID, so writing an ID twice
+    updates the earlier result in place (keeping its position in the output).
+
+    Results may carry the tiles they were computed from, as
+    ``{tile name: version}``. These are committed with the result, so the
+    dependency map always matches the stored results, and are used by
+    ``stale_ids`` to find the results an update of the tiles invalidates.
+
+    With a ``StatisticSet``, its statistics are stored with each result and
+    exported after the standard columns. Results stored without the ones
+    that need the pixels (e.g. by a run that did not ask for them) are not
+    counted as completed, so they are recomputed.
+    """
+
+    def __init__(self, path, batch_size=256, batch_seconds=5.0, statistics=None):
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        self.statistics = statistics
+        self._pending = []
+        self._pending_tiles = []
+        self._last_commit = time.monotonic()
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(SCHEMA)
+        self._conn.executescript(DEPENDENCY_SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+        self._conn.commit()
+
+    @staticmethod
+    def default_path(output_path):
+        return os.path.splitext(output_path)[0] + ".sqlite"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def completed_ids(self):
+        if self.statistics is None:
+            return {row[0] for row in self._conn.execute("SELECT id FROM results")}
+        # Rows imported from a legacy CSV only hold the mean, so the statistics need them recomputed.
+        # Polygons without an elevation have nothing to add; the rest need every pixel statistic.
+        names = set(self.statistics.pixel_names)
+        return {id_ for id_, mean, extra in self._conn.execute(
+                    "SELECT id, mean, extra FROM results WHERE count IS NOT NULL")
+                if mean is None or not names or (extra is not None and names.issubset(json.loads(extra)))}
+
+    def put(self, feature_id, stats, tiles=None):
+        """
+        Record the summary of one polygon; empty summaries are kept so they are
+        not retried. ``tiles`` (``{tile name: version}``) replaces the
+        polygon's dependencies when given.
+        """
+        if tiles is not None:
+            self._pending_tiles.append((str(feature_id), tiles))
+        extra = None
+        if self.statistics is not None and self.statistics.needs_pixels and stats:
+            extra = json.dumps(self.statistics.pixel_values(stats))
+        self._pending.append((
+            str(feature_id), stats.mean if stats else None, stats.count,
+            stats.total, stats.total_sq,
+            stats.minimum if stats else None, stats.maximum if stats else None,
+            stats.area, stats.area_total, extra,
+        ))
+        if (len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_commit >= self.batch_seconds):
+            self.commit()
+
+    def commit(self):
+        if self._pending or self._pending_tiles:
+            with self._conn:
+                # Upsert rather than replace, so an updated row keeps its rowid and output position
+                placeholders = ", ".join("?" * len(RESULT_COLUMNS))
+                self._conn.executemany(
+                    f"INSERT INTO results ({', '.join(RESULT_COLUMNS)}) VALUES ({placeholders}) "
+                    "ON CONFLICT (id) DO UPDATE SET "
+                    + ", ".join(f"{column} = excluded.{column}" for column in RESULT_COLUMNS[1:]),
+                    self._pending)
+                # An ID written twice in one batch keeps the tiles it was written with last
+                pending_tiles = dict(self._pending_tiles)
+                self._conn.executemany("DELETE FROM tiles WHERE id = ?", [(id_,) for id_ in pending_tiles])
+                self._conn.executemany("INSERT INTO tiles VALUES (?, ?, ?)", [
+                    (id_, tile, version) for id_, tiles in pending_tiles.items() for tile, version in tiles.items()])
+            self._pending = []
+            self._pending_tiles = []
+        self._last_commit = time.monotonic()
+
+    def put_tiles(self, feature_id, tiles):
+        """Record the dependencies of a stored result without changing it (e.g. to backfill the map)."""
+        self._pending_tiles.append((str(feature_id), tiles))
+
+    def tile_set(self):
+        """The ``{tile name: version}`` the store was last brought up to date with (empty if never)."""
+        return dict(self._conn.execute("SELECT tile, version FROM tile_set"))
+
+    def save_tile_set(self, versions):
+        self.commit()
+        with self._conn:
+            self._conn.execute("DELETE FROM tile_set")
+            self._conn.executemany("INSERT INTO tile_set VALUES (?, ?)", versions.items())
+
+    def stale_ids(self, versions):
+        """
+        IDs of the results computed from a tile that has since changed or
+        disappeared, given the current ``{tile name: version}``.
+        """
+        self.commit()
+        changed = [(tile, version) for tile, version in self._conn.execute("SELECT DISTINCT tile, version FROM tiles")
+                   if versions.get(tile) != version]
+        stale = set()
+        for tile, version in changed:
+            stale.update(row[0] for row in self._conn.execute(
+                "SELECT id FROM tiles WHERE tile = ? AND version = ?", (tile, version)))
+        return stale
+
+    def dependent_ids(self, versions):
+        """IDs of the results computed from any of the tiles in ``{tile name: version}`` at that version."""
+        self.commit()
+        ids = set()
+        for tile, version in versions.items():
+            ids.update(row[0] for row in self._conn.execute(
+                "SELECT id FROM tiles WHERE tile = ? AND version = ?", (tile, version)))
+        return ids
+
+    def get(self, feature_id):
+        row = self._conn.execute(f"SELECT {', '.join(STATS_COLUMNS)} FROM results WHERE id = ?",
+                                 (str(feature_id),)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return _row_stats(row)
+
+    def import_csv(self, csv_path):
+        """
+        Seed the store from an existing output CSV, e.g. one written before the
+        store existed (which only has the average elevation). Torn or
+        malformed lines (e.g. from a killed run) are skipped and will be
+        recomputed. Returns the number of rows imported.
+        """
+        rows = []
+        with open(csv_path, 'r', newline='') as csvfile:
+            reader = csv.reader(csvfile)
+            header = next(reader, [])
+            positions = {name: i for i, name in enumerate(header)}
+            columns = [(column, positions[name]) for name, column in CSV_COLUMNS if name in positions]
+            if not columns or columns[0][0] != "mean":
+                return 0
+            for row in reader:
+                try:
+                    values = [row[0]] + [float(row[i]) if row[i] != "" else None for _, i in columns]
+                except (IndexError, ValueError):
+                    continue
+                rows.append(values)
+
+        names = ", ".join(["id"] + [column for column, _ in columns])
+        placeholders = ", ".join("?" * (len(columns) + 1))
+        with self._conn:
+            self._conn.executemany(f"INSERT OR IGNORE INTO results ({names}) VALUES ({placeholders})", rows)
+        return len(rows)
+
+    def export(self, path, id_header):
+        """Export to CSV or Parquet, chosen by the extension of ``path``."""
+        if is_parquet(path):
+            self.export_parquet(path, id_header)
+        else:
+            self.export_csv(path, id_header)
+
+    # Function to list the output headers: the standard columns, then the statistics asked for
+    def _headers(self):
+        headers = [name for name, _ in CSV_COLUMNS]
+        if self.statistics is not None:
+            headers += self.statistics.headers()
+        return headers
+
+    # Function to stream the exported rows of every polygon that has an elevation, in output order
+    def _export_rows(self):
+        columns = ", ".join(column for _, column in CSV_COLUMNS)
+        if self.statistics is None:
+            yield from self._conn.execute(f"SELECT id, {columns} FROM results WHERE mean IS NOT NULL ORDER BY rowid")
+            return
+        cursor = self._conn.execute(f"SELECT id, {columns}, {', '.join(STATS_COLUMNS)}, extra FROM results "
+                                    "WHERE mean IS NOT NULL ORDER BY rowid")
+        width = len(CSV_COLUMNS) + 1
+        for row in cursor:
+            stats = _row_stats(row[width:width + len(STATS_COLUMNS)])
+            pixel_values = json.loads(row[-1]) if row[-1] is not None else {}
+            yield row[:width] + tuple(self.statistics.values(stats, pixel_values))
+
+    def export_csv(self, csv_path, id_header):
+        """
+        Atomically rewrite ``csv_path`` with every polygon that has an
+        elevation: its mean plus the additive partial sums it came from, and
+        the statistics of the store's ``StatisticSet``.
+        """
+        self.commit()
+        tmp_path = csv_path + ".tmp"
+        with open(tmp_path, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow([id_header] + self._headers())
+            writer.writerows(self._export_rows())
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+        os.replace(tmp_path, csv_path)
+
+    def export_parquet(self, parquet_path, id_header, row_group_size=ROW_GROUP_SIZE):
+        """
+        Atomically rewrite ``parquet_path`` with the same columns as
+        ``export_csv``, typed (string IDs, integer pixel counts, float
+        statistics) and streamed from the store one row group at a time.
+        """
+        self.commit()
+        schema = [(id_header, pa.string())] + [(name, PARQUET_TYPES[column]) for name, column in CSV_COLUMNS]
+        if self.statistics is not None:
+            schema += [(name, pa.float64()) for name in self.statistics.headers()]
+        rows = self._export_rows()
+        with ParquetBatchWriter(parquet_path, schema) as writer:
+            for batch in iter(lambda: list(itertools.islice(rows, row_group_size)), []):
+                writer.write_rows(batch)
+
+    def close(self):
+        self.commit()
+        self._conn.close()
+
+
+# Function to rebuild a summary from its stored result columns (see ``STATS_COLUMNS``)
+def _row_stats(row):
+    count, total, total_sq, minimum, maximum, area, area_total = row
+    return ElevationStats(count, total, total_sq,
+                          math.inf if minimum is None else minimum,
+                          -math.inf if maximum is None else maximum,
+                          area or 0.0, area_total or 0.0)
@@ -1,84 +1,113 @@
+import argparse
+import json
 import os
-import requests
-import zipfile
-import shutil
-import geopandas as gpd
-import pandas as pd  # ✅ Fix: Import pandas
-import rasterio
-from rasterio.mask import mask
-import numpy as np
 import subprocess
-import tempfile
-import csv
+import sys
+
+import geopandas as gpd
 from tqdm import tqdm
 
+from fips import STATE_FIPS
+from polygon_dataset import partition_path, write_partition
+from tile_downloader import iter_downloads
+
 # Define directories
 script_dir = os.path.dirname(os.path.abspath(__file__))
 tracts_dir = os.path.join(script_dir, "tracts")
-elevation_dir = os.path.join(script_dir, "elevation_tiles")
-output_csv = os.path.join(script_dir, "county_weighted_elevation.csv")
+tracts_dataset = os.path.join(script_dir, "tl_2024_us_tract.parquet")
+manifest_path = os.path.join(tracts_dataset, "manifest.json")
 
 # Census tract download URL template
 BASE_URL = "https://www2.census.gov/geo/tiger/TIGER2024/TRACT/"
-STATE_FIPS = [f"{i:02d}" for i in range(1, 57)]  # 01-56 for all states (excluding territories)
 
-# Ensure tracts directory exists
-os.makedirs(tracts_dir, exist_ok=True)
 
-# Function to download and extract Census Tract files
-def download_and_extract_tracts():
-    for state in tqdm(STATE_FIPS, desc="Downloading Census Tract Shapefiles"):
-        zip_filename = f"tl_2024_{state}_tract.zip"
-        zip_path = os.path.join(tracts_dir, zip_filename)
-        shapefile_path = os.path.join(tracts_dir, f"tl_2024_{state}_tract.shp")
+# Function to name the tract ZIP of one state
+def tract_zip_name(state):
+    return f"tl_2024_{state}_tract.zip"
+
+
+# Function to read a state's tract Shapefile straight out of its ZIP through GDAL's /vsizip/
+def read_state_tracts(zip_path, state):
+    return gpd.read_file(f"/vsizip/{zip_path}/tl_2024_{state}_tract.shp")
+
+
+def load_manifest(path):
+    if os.path.exists(path):
+        with open(path, "r") as f:
+            return json.load(f)
+    return {}
+
 
-        # Skip if already extracted
-        if os.path.exists(shapefile_path):
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def build_tract_dataset(states=STATE_FIPS, workers=8):
+    """
+    Download the tract ZIP of every state in ``states`` concurrently and write
+    each one as a partition of the state-partitioned GeoParquet dataset. Each
+    state is read straight from its ZIP and written while the remaining
+    downloads continue. Finished states are recorded in a manifest (ZIP size,
+    ETag and tract count) and skipped on the next run. Raises RuntimeError
+    naming every state that is still missing at the end.
+    """
+    os.makedirs(tracts_dir, exist_ok=True)
+    os.makedirs(tracts_dataset, exist_ok=True)
+    manifest = load_manifest(manifest_path)
+
+    def is_done(state):
+        return state in manifest and os.path.exists(partition_path(tracts_dataset, "STATEFP", state))
+
+    urls = {BASE_URL + tract_zip_name(state): state for state in states if not is_done(state)}
+    downloads = iter_downloads(list(urls), tracts_dir, workers=workers)
+    for url, info, error in tqdm(downloads, total=len(urls), desc="Downloading Census Tracts"):
+        state = urls[url]
+        if error is not None:
+            print(f"Failed to download {tract_zip_name(state)}: {error}")
             continue
 
-        # Download file
-        url = BASE_URL + zip_filename
+        zip_path = os.path.join(tracts_dir, tract_zip_name(state))
         try:
-            response = requests.get(url, stream=True)
-            if response.status_code == 200:
-                with open(zip_path, "wb") as file:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        file.write(chunk)
+            tracts = read_state_tracts(zip_path, state)
+        except Exception as e:
+            # Drop the unreadable ZIP so the next run downloads it again
+            print(f"Failed to read {tract_zip_name(state)}: {e}")
+            os.remove(zip_path)
+            continue
+        if tracts.empty:
+            print(f"{tract_zip_name(state)} contains no tracts")
+            continue
 
-                # Extract the ZIP file
-                with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                    zip_ref.extractall(tracts_dir)
+        write_partition(tracts, tracts_dataset, "STATEFP", state)
+        size, etag = info if info is not None else (os.path.getsize(zip_path), None)
+        manifest[state] = {"zip": tract_zip_name(state), "size": size, "etag": etag, "tracts": len(tracts)}
+        save_manifest(manifest_path, manifest)
 
-                # Remove ZIP file after extraction
-                os.remove(zip_path)
-            else:
-                print(f"Failed to download {zip_filename}: {response.status_code}")
+    missing = [state for state in states if not is_done(state)]
+    if missing:
+        raise RuntimeError(f"Census tracts are missing for {len(missing)} states ({', '.join(missing)}); "
+                           "run the script again to retry them.")
+    return manifest
 
-        except Exception as e:
-            print(f"Error downloading {zip_filename}: {e}")
 
-# Run the download function
-download_and_extract_tracts()
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the nationwide census tract dataset and compute tract elevations.")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent state downloads")
+    args = parser.parse_args()
 
-# Merge all state tract files into one nationwide file
-print("Merging Census Tract Shapefiles...")
-all_tracts = gpd.GeoDataFrame()
-for state in STATE_FIPS:
-    shapefile_path = os.path.join(tracts_dir, f"tl_2024_{state}_tract.shp")
-    if os.path.exists(shapefile_path):
-        gdf = gpd.read_file(shapefile_path)
-        all_tracts = pd.concat([all_tracts, gdf])  # ✅ Fix: Ensure pandas is imported
+    manifest = build_tract_dataset(workers=args.workers)
+    print(f"✅ Nationwide Census Tract dataset saved ({sum(entry['tracts'] for entry in manifest.values())} tracts).")
 
-# Save merged tracts to one file
-merged_tract_file = os.path.join(script_dir, "tl_2024_us_tract.shp")
-all_tracts.to_file(merged_tract_file)
-print("✅ Merged nationwide Census Tract shapefile saved.")
+    # Run the tract elevation analysis, which reads the dataset one state at a time
+    print("Running elevation analysis...")
+    subprocess.run([sys.executable, os.path.join(script_dir, "zonal_stats.py"), "tract"], check=True)
 
-# Define path to population CSV
-population_csv = os.path.join(script_dir, "census_population.csv")
+    print("✅ All processes complete.")
 
-# Run the elevation script (modify path as needed)
-print("Running elevation analysis...")
-subprocess.run(["python3", os.path.join(script_dir, "elevation_script.py")])
 
-print("✅ All processes complete.")
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,10 @@
+import argparse
 import os
 import requests
 import zipfile
 
+from tile_downloader import download_files, read_links
+
 # Get the directory where the script is located
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -75,39 +78,31 @@ def extract_zip(zip_path, extract_to, required_files):
         print(f"Failed to extract {zip_path}: {e}")
         exit(1)
 
-# Function to download TIF files
-def download_files(url_file, save_dir):
-    if not os.path.exists(save_dir):
-        os.makedirs(save_dir)
-    with open(url_file, "r") as file:
-        urls = file.readlines()
-    for url in urls:
-        url = url.strip()
-        if not url:
-            continue
-        filename = os.path.basename(url)
-        save_path = os.path.join(save_dir, filename)
-        if os.path.exists(save_path):
-            print(f"Skipping {filename}, already exists.")
-            continue
-        print(f"Downloading {filename}...")
-        try:
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            with open(save_path, "wb") as file:
-                for chunk in response.iter_content(chunk_size=8192):
-                    file.write(chunk)
-            print(f"Downloaded {filename} to {save_dir}.")
-        except Exception as e:
-            print(f"Failed to download {filename}: {e}")
-
-# Download and extract ZCTA data
-download_zip(zcta_zip_url, zcta_zip_filename)
-extract_zip(zcta_zip_filename, extract_folder, REQUIRED_FILES["zcta"])
-
-# Download and extract COUNTY data
-download_zip(county_zip_url, county_zip_filename)
-extract_zip(county_zip_filename, extract_folder, REQUIRED_FILES["county"])
-
-# Download elevation TIF files
-download_files(tif_links_file, elevation_folder)
+def main():
+    parser = argparse.ArgumentParser(description="Download the ZCTA/county shapefiles and the elevation tiles.")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent tile downloads")
+    parser.add_argument("--max-mbps", type=float, help="Cap on total download bandwidth in megabits per second")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Check existing tiles against the server (size, ETag or MD5 checksum) and "
+                             "download the ones that were republished")
+    args = parser.parse_args()
+
+    # Download and extract ZCTA data
+    download_zip(zcta_zip_url, zcta_zip_filename)
+    extract_zip(zcta_zip_filename, extract_folder, REQUIRED_FILES["zcta"])
+
+    # Download and extract COUNTY data
+    download_zip(county_zip_url, county_zip_filename)
+    extract_zip(county_zip_filename, extract_folder, REQUIRED_FILES["county"])
+
+    # Download elevation TIF files
+    _, failed = download_files(read_links(tif_links_file), elevation_folder, workers=args.workers,
+                               max_bytes_per_sec=args.max_mbps * 1e6 / 8 if args.max_mbps else None,
+                               refresh=args.refresh)
+    if failed:
+        print(f"{len(failed)} tiles failed to download; run the script again to retry them.")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import math
+
+import numpy as np
+
+# Range in metres of the elevation histograms; values outside it fall in the end bins
+HISTOGRAM_RANGE = (-500.0, 9000.0)
+
+# Output column headers of the statistics a StatisticSet can add
+STATISTIC_HEADERS = {
+    "min": "Minimum Elevation",
+    "max": "Maximum Elevation",
+    "std": "Elevation Std Dev",
+    "median": "Median Elevation",
+    "slope": "Mean Slope Degrees",
+}
+
+
+class StatisticSet:
+    """
+    Statistics to report for every polygon beyond the mean, parsed from names
+    such as ``["min", "max", "std", "median", "p90", "above:1500", "slope"]``:
+
+    - ``min``, ``max``, ``std``: exact, from the fields every summary keeps;
+    - ``median`` and ``pNN`` (the NN-th percentile): interpolated from a
+      histogram of ``bin_width``-metre bins, so they are within one bin of
+      the exact value and merge across tiles like the other partial sums;
+    - ``above:T``: the share of the polygon's ground area above T metres;
+    - ``slope``: the mean slope in degrees, from the elevation differences
+      between each pixel's neighbours (pixels next to missing data or the
+      edge of a read are left out).
+
+    All of them are accumulated in the same pass over the pixels as the mean.
+    """
+
+    def __init__(self, names, bin_width=1.0):
+        if not bin_width > 0:
+            raise ValueError(f"Histogram bin width must be positive, got {bin_width}")
+        self.names = []
+        self.bin_width = bin_width
+        self.percentiles = {}
+        self.thresholds = []
+        self.slope = False
+        for name in names:
+            if name == "median":
+                self.percentiles[name] = 50.0
+            elif name.startswith("p") and name[1:].replace(".", "", 1).isdigit() and float(name[1:]) <= 100:
+                self.percentiles[name] = float(name[1:])
+            elif name.startswith("above:"):
+                try:
+                    threshold = float(name[len("above:"):])
+                except ValueError:
+                    raise ValueError(f"Invalid threshold in {name!r}; expected e.g. above:1500") from None
+                self.thresholds.append(threshold)
+                name = f"above:{threshold:g}"
+            elif name == "slope":
+                self.slope = True
+            elif name not in STATISTIC_HEADERS:
+                raise ValueError(f"Unknown statistic {name!r}; expected min, max, std, median, pNN, "
+                                 f"above:<metres> or slope")
+            self.names.append(name)
+        self.bins = math.ceil((HISTOGRAM_RANGE[1] - HISTOGRAM_RANGE[0]) / bin_width)
+
+    @classmethod
+    def parse(cls, spec, bin_width=1.0):
+        """Build a set from a comma-separated list of names, e.g. ``"min,max,p90"``."""
+        return cls([name.strip() for name in spec.split(",") if name.strip()], bin_width)
+
+    @property
+    def needs_pixels(self):
+        """Whether any statistic needs more than the fields of a plain summary."""
+        return bool(self.percentiles or self.thresholds or self.slope)
+
+    @property
+    def pixel_names(self):
+        """Names of the statistics that need the pixels, as keys of ``pixel_values``."""
+        return [name for name in self.names if name not in ("min", "max", "std")]
+
+    def headers(self):
+        headers = []
+        for name in self.names:
+            if name in STATISTIC_HEADERS:
+                headers.append(STATISTIC_HEADERS[name])
+            elif name.startswith("above:"):
+                headers.append(f"Area Share Above {name[len('above:'):]} m")
+            else:
+                headers.append(f"{name.upper()} Elevation")
+        return headers
+
+    # Function to map values to their histogram bins
+    def bin_indices(self, values):
+        indices = np.floor((values - HISTOGRAM_RANGE[0]) / self.bin_width)
+        return np.clip(indices, 0, self.bins - 1).astype(np.intp)
+
+    def percentile(self, stats, q):
+        """The ``q``-th percentile of a summary's pixels, interpolated within its histogram bin."""
+        if not stats.count or stats.histogram is None:
+            return math.nan
+        cumulative = np.cumsum(stats.histogram)
+        target = q / 100 * cumulative[-1]
+        index = min(int(np.searchsorted(cumulative, target)), len(cumulative) - 1)
+        in_bin = stats.histogram[index]
+        fraction = (target - (cumulative[index] - in_bin)) / in_bin if in_bin else 0.0
+        value = HISTOGRAM_RANGE[0] + (stats.histogram_start + index + fraction) * self.bin_width
+        return float(min(max(value, stats.minimum), stats.maximum))
+
+    def pixel_values(self, stats):
+        """``{name: value}`` of the statistics that need the pixels (see ``needs_pixels``)."""
+        values = {name: self.percentile(stats, q) for name, q in self.percentiles.items()}
+        if stats.area_above is not None:
+            for threshold, area in zip(self.thresholds, stats.area_above):
+                values[f"above:{threshold:g}"] = area / stats.area if stats.area else math.nan
+        if self.slope:
+            values["slope"] = stats.slope_total / stats.slope_count if stats.slope_count else math.nan
+        return values
+
+    def values(self, stats, pixel_values=None):
+        """
+        The statistics of a summary, in the order of ``headers``. Those that
+        need the pixels are taken from ``pixel_values`` when given (as stored
+        by ``pixel_values``), and are NaN when they are unknown.
+        """
+        if pixel_values is None:
+            pixel_values = self.pixel_values(stats)
+        known = stats is not None and bool(stats.count)
+        row = []
+        for name in self.names:
+            if name == "min":
+                row.append(stats.minimum if known else math.nan)
+            elif name == "max":
+                row.append(stats.maximum if known else math.nan)
+            elif name == "std":
+                row.append(stats.std if known else math.nan)
+            else:
+                row.append(pixel_values.get(name, math.nan))
+        return row
+
+
+def slope_degrees(data, valid, row_areas, pixel_height):
+    """
+    Slope in degrees at every pixel of the window ``data``, from central
+    differences with its four neighbours. ``row_areas`` (the ground area of
+    a pixel in each row) divided by ``pixel_height`` (in metres) gives the
+    pixel width, which shrinks towards the poles on a geographic grid.
+    Pixels along the edge of the window or next to a pixel not flagged in
+    ``valid`` get NaN.
+    """
+    slope = np.full(data.shape, np.nan, dtype=np.float32)
+    if data.shape[0] < 3 or data.shape[1] < 3:
+        return slope
+    z = np.where(valid, data, np.float32(np.nan)).astype(np.float32, copy=False)
+    pixel_width = (row_areas[1:-1] / pixel_height).astype(np.float32)[:, None]
+    dz_dx = (z[1:-1, 2:] - z[1:-1, :-2]) / (2 * pixel_width)
+    dz_dy = (z[2:, 1:-1] - z[:-2, 1:-1]) / np.float32(2 * pixel_height)
+    slope[1:-1, 1:-1] = np.degrees(np.arctan(np.hypot(dz_dx, dz_dy)))
+    return slope
+
+
+class ElevationStats:
+    """
+    Running summary of elevation values (count, sum, sum of squares, min, max,
+    and optionally the pixel area in m² and the area-weighted sum).
+
+    Values are folded in one window at a time and accumulated in float64, so
+    no pixel arrays are kept alive between reads. Every field except min/max
+    is an additive partial sum: summaries computed for different tiles of the
+    same polygon, or for different polygons of a larger region, combine
+    exactly with ``merge``.
+
+    With a ``StatisticSet`` that needs the pixels, the summary also keeps the
+    partial sums behind it (an elevation histogram, the ground area above
+    each threshold, the sum and count of slopes), which merge the same way.
+    The histogram only spans the bins from ``histogram_start`` to the
+    highest one the polygon's pixels fall in.
+    """
+
+    __slots__ = ("count", "total", "total_sq", "minimum", "maximum", "area", "area_total",
+                 "statistics", "histogram", "histogram_start", "area_above", "slope_total", "slope_count")
+
+    def __init__(self, count=0, total=0.0, total_sq=0.0, minimum=math.inf, maximum=-math.inf,
+                 area=0.0, area_total=0.0, statistics=None):
+        self.count = count
+        self.total = total
+        self.total_sq = total_sq
+        self.minimum = minimum
+        self.maximum = maximum
+        self.area = area
+        self.area_total = area_total
+        self.statistics = statistics if statistics is not None and statistics.needs_pixels else None
+        self.histogram = None
+        self.histogram_start = 0
+        self.area_above = None
+        self.slope_total = 0.0
+        self.slope_count = 0
+        if self.statistics is not None and self.statistics.thresholds:
+            self.area_above = np.zeros(len(self.statistics.thresholds))
+
+    def add_pixel_statistics(self, values, areas=None, slopes=None):
+        """
+        Fold valid elevation ``values`` (with their pixel ``areas`` and
+        ``slopes`` when known; NaN slopes are left out) into the histogram,
+        area above thresholds and slope sums only. Callers that take the
+        other fields per label, like the tile-major strategy, use this.
+        """
+        if self.statistics is None or values.size == 0:
+            return self
+        if self.statistics.percentiles:
+            self._add_histogram_values(values)
+        if self.area_above is not None:
+            weights = areas if areas is not None else np.ones(values.size)
+            for i, threshold in enumerate(self.statistics.thresholds):
+                self.area_above[i] += float(weights[values > threshold].sum())
+        if slopes is not None and self.statistics.slope:
+            sloped = ~np.isnan(slopes)
+            self.slope_total += float(slopes[sloped].sum(dtype=np.float64))
+            self.slope_count += int(np.count_nonzero(sloped))
+        return self
+
+    # Function to count values into their histogram bins
+    def _add_histogram_values(self, values):
+        indices = self.statistics.bin_indices(values)
+        start = int(indices.min())
+        self._add_histogram(start, np.bincount(indices - start))
+
+    # Function to add the counts of the histogram bins from ``start`` on, widening its range as needed
+    def _add_histogram(self, start, counts):
+        if self.histogram is None:
+            self.histogram_start, self.histogram = start, counts.astype(np.int64)
+            return
+        low = min(self.histogram_start, start)
+        high = max(self.histogram_start + len(self.histogram), start + len(counts))
+        if (low, high) != (self.histogram_start, self.histogram_start + len(self.histogram)):
+            widened = np.zeros(high - low, dtype=np.int64)
+            widened[self.histogram_start - low:self.histogram_start - low + len(self.histogram)] = self.histogram
+            self.histogram_start, self.histogram = low, widened
+        self.histogram[start - low:start - low + len(counts)] += counts
+
+    def add_window(self, data, valid, row_areas=None, band_rows=256, slope=None):
+        """
+        Fold the pixels of the 2-D window ``data`` flagged in ``valid`` into
+        the summary, with the ground area of one pixel in each row in
+        ``row_areas`` when it is known, and the slope of each pixel (see
+        ``slope_degrees``) in ``slope`` when the statistics include it.
+
+        The window is never gathered into one float64 copy: it is reduced
+        in bands of ``band_rows`` rows, with unflagged pixels (including NaN)
+        zeroed in the band, and the pixel areas applied per row instead of
+        per pixel.
+        """
+        for start in range(0, data.shape[0], band_rows):
+            mask = valid[start:start + band_rows]
+            row_counts = np.count_nonzero(mask, axis=1)
+            if not row_counts.any():
+                continue
+            raw = data[start:start + band_rows]
+            band = np.where(mask, raw, np.float64(0.0))
+            row_totals = band.sum(axis=1)
+            values = raw[mask]
+            self.count += int(row_counts.sum())
+            self.total += float(row_totals.sum())
+            self.total_sq += float(np.einsum("ij,ij->", band, band))
+            self.minimum = min(self.minimum, float(values.min()))
+            self.maximum = max(self.maximum, float(values.max()))
+            if row_areas is not None:
+                areas = row_areas[start:start + band_rows]
+                self.area += float(np.dot(row_counts, areas))
+                self.area_total += float(np.dot(row_totals, areas))
+            if self.statistics is not None:
+                self._add_band_pixels(raw, mask, values, areas if row_areas is not None else None,
+                                      None if slope is None else slope[start:start + band_rows])
+        return self
+
+    # Function to fold the histogram, area above thresholds and slopes of one band
+    def _add_band_pixels(self, raw, mask, values, areas, slope):
+        if self.statistics.percentiles:
+            self._add_histogram_values(values)
+        if self.area_above is not None:
+            for i, threshold in enumerate(self.statistics.thresholds):
+                above = np.count_nonzero(mask & (raw > threshold), axis=1)
+                self.area_above[i] += float(np.dot(above, areas) if areas is not None else above.sum())
+        if slope is not None:
+            sloped = mask & ~np.isnan(slope)
+            self.slope_total += float(slope[sloped].sum(dtype=np.float64))
+            self.slope_count += int(np.count_nonzero(sloped))
+
+    def merge(self, other):
+        """Combine the summary of another tile (or window) into this one."""
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        self.area += other.area
+        self.area_total += other.area_total
+        if other.histogram is not None:
+            self._add_histogram(other.histogram_start, other.histogram)
+        if other.area_above is not None:
+            self.area_above = other.area_above.copy() if self.area_above is None else self.area_above + other.area_above
+        self.slope_total += other.slope_total
+        self.slope_count += other.slope_count
+        if self.statistics is None:
+            self.statistics = other.statistics
+        return self
+
+    def __bool__(self):
+        return self.count > 0
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else math.nan
+
+    @property
+    def std(self):
+        if not self.count:
+            return math.nan
+        variance = self.total_sq / self.count - self.mean ** 2
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def area_mean(self):
+        """Mean elevation weighted by pixel ground area."""
+        return self.area_total / self.area if self.area else math.nan
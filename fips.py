@@ -0,0 +1,10 @@
+# State FIPS codes of the 50 states and the District of Columbia. The codes
+# in 01-56 that are not listed (03, 07, 14, 43, 52) are unassigned.
+STATE_FIPS = [
+    "01", "02", "04", "05", "06", "08", "09", "10", "11", "12",
+    "13", "15", "16", "17", "18", "19", "20", "21", "22", "23",
+    "24", "25", "26", "27", "28", "29", "30", "31", "32", "33",
+    "34", "35", "36", "37", "38", "39", "40", "41", "42", "44",
+    "45", "46", "47", "48", "49", "50", "51", "53", "54", "55",
+    "56",
+]
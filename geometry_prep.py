@@ -0,0 +1,76 @@
+import numpy as np
+import shapely
+
+# Pixel size of the USGS 1/3 arc-second tiles, in degrees
+USGS_13_PIXEL = 1 / 10800
+
+
+# Function to read the CRS and pixel size of the tiles in a catalog
+def raster_grid(catalog):
+    if catalog is None or not catalog.tiles:
+        return None, USGS_13_PIXEL
+    tile = catalog.tiles[0]
+    return tile.crs, max(abs(tile.affine.a), abs(tile.affine.e))
+
+
+def simplify_geometries(geometries, tolerance, coverage=False):
+    """
+    Simplify ``geometries`` to ``tolerance`` (in CRS units) without changing
+    their topology: polygons stay valid and holes are kept. Returns the
+    simplified geometries and, per geometry, the area of the symmetric
+    difference with the original as a share of the original area. Only
+    pixels whose centres fall in that difference can be counted differently
+    from the exact geometry, so it bounds the share of the polygon's pixels
+    the simplification can change.
+
+    Each polygon is simplified on its own, so neighbours may overlap
+    afterwards. With ``coverage``, the geometries must form a coverage (no
+    overlaps, shared edges with identical vertices) and are simplified
+    together with ``shapely.coverage_simplify`` (shapely 2.1 or later), so
+    shared edges stay shared; ``tolerance`` is then roughly the square root
+    of the area of the triangles removed. Raises ValueError when they do not
+    form a coverage.
+    """
+    geometries = np.asarray(geometries, dtype=object)
+    if coverage:
+        if not hasattr(shapely, "coverage_simplify"):
+            raise ValueError("Simplifying polygons as a coverage needs shapely 2.1 or later")
+        present = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        if not shapely.coverage_is_valid(geometries[present]):
+            raise ValueError("The polygons overlap or their shared edges do not match, "
+                             "so they cannot be simplified as a coverage")
+        simplified = geometries.copy()
+        simplified[present] = shapely.coverage_simplify(geometries[present], tolerance)
+    else:
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    area = shapely.area(geometries)
+    changed = shapely.area(shapely.symmetric_difference(geometries, simplified))
+    error = np.divide(changed, area, out=np.zeros_like(area), where=area > 0)
+    return simplified, error
+
+
+def prepare_polygons(polygons, crs, pixel_size, simplify_pixels=None, coverage=False):
+    """
+    Reproject the GeoDataFrame ``polygons`` to the raster CRS ``crs`` (once,
+    instead of per tile) and, with ``simplify_pixels``, simplify them to that
+    many pixels (e.g. 0.5), as a coverage with ``coverage``. Returns the
+    prepared GeoDataFrame and the per-polygon error bound from
+    ``simplify_geometries`` (all zeros without simplification).
+    """
+    if crs is not None and polygons.crs is not None and polygons.crs != crs:
+        polygons = polygons.to_crs(crs)
+    error = np.zeros(len(polygons))
+    if simplify_pixels:
+        simplified, error = simplify_geometries(polygons.geometry.to_numpy(), simplify_pixels * pixel_size,
+                                                coverage)
+        polygons = polygons.set_geometry(simplified, crs=polygons.crs)
+    return polygons, error
+
+
+# Function to describe the vertex savings and error bound of a simplification
+def describe_simplification(vertices_before, vertices_after, error):
+    if len(error) == 0:
+        return "No polygons simplified"
+    return (f"Simplified {len(error)} polygons from {vertices_before} to {vertices_after} vertices; "
+            f"at most {np.max(error):.4%} of a polygon's area changed "
+            f"(median {np.median(error):.4%}, mean {np.mean(error):.4%})")
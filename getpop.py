@@ -1,41 +1,160 @@
-import requests
+import argparse
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 import pandas as pd
+from tqdm import tqdm
+from urllib3.util.retry import Retry
+
+from fips import STATE_FIPS
+from table_io import write_table
+from tile_downloader import TIMEOUT, SessionPool
+
+# Census API URL ({year} is filled in per request)
+BASE_URL = "https://api.census.gov/data/{year}/acs/acs5"
+POPULATION_VARIABLE = "B01003_001E"
+
+# Define paths
+cache_dir = "census_cache"
+output_parquet = "census_acs.parquet"
+output_csv = "census_population.csv"
+
+# ACS marks unavailable estimates with large negative sentinels (e.g. -666666666)
+ACS_MISSING_THRESHOLD = -99999999
+
+
+# Function to locate the cached response of one (year, variable, state)
+def cache_path(year, variable, state):
+    return os.path.join(cache_dir, str(year), variable, f"{state}.json")
+
+
+def fetch_state(session, base_url, year, variables, state, api_key=None):
+    """
+    Fetch tract-level ``variables`` for one state and year from the ACS API.
+    Returns ``{variable: [[GEOID, value], ...]}``.
+    """
+    params = {"get": ",".join(variables), "for": "tract:*", "in": f"state:{state}"}
+    if api_key:
+        params["key"] = api_key
+    resp = session.get(base_url.format(year=year), params=params, timeout=TIMEOUT)
+    resp.raise_for_status()
+    data = resp.json()
+    header, rows = data[0], data[1:]
+    state_col, county_col, tract_col = header.index("state"), header.index("county"), header.index("tract")
+    geoids = [row[state_col] + row[county_col] + row[tract_col] for row in rows]
+    return {
+        variable: [[geoid, row[header.index(variable)]] for geoid, row in zip(geoids, rows)]
+        for variable in variables
+    }
+
+
+def load_state(session, base_url, year, variables, state, api_key=None):
+    """Return cached responses for (year, variable, state), fetching the missing variables."""
+    results = {}
+    missing = []
+    for variable in variables:
+        path = cache_path(year, variable, state)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                results[variable] = json.load(f)
+        else:
+            missing.append(variable)
+
+    if missing:
+        fetched = fetch_state(session, base_url, year, missing, state, api_key)
+        for variable, rows in fetched.items():
+            path = cache_path(year, variable, state)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(rows, f)
+            os.replace(tmp_path, path)
+            results[variable] = rows
+    return results
+
+
+# Function to convert ACS string estimates to numbers, with sentinels as missing
+def to_numeric(values):
+    numbers = pd.to_numeric(values, errors="coerce")
+    numbers = numbers.mask(numbers <= ACS_MISSING_THRESHOLD)
+    if numbers.dropna().mod(1).eq(0).all():
+        return numbers.astype("Int64")
+    return numbers.astype("float64")
+
+
+def fetch_acs(years, variables, states=STATE_FIPS, base_url=BASE_URL, workers=8, retries=5, api_key=None):
+    """
+    Fetch tract-level ACS ``variables`` for every year in ``years`` and every
+    state, running the state requests concurrently over pooled keep-alive
+    sessions. Failed requests are retried with exponential backoff, and raw
+    responses are cached on disk per (year, variable, state), so a rerun only
+    fetches what is missing. Returns a DataFrame with one row per (GEOID,
+    Year) and one typed column per variable.
+    """
+    retry = Retry(total=retries, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",))
+    sessions = SessionPool(workers, max_retries=retry)
+    jobs = [(year, state) for year in years for state in states]
+
+    def fetch(year, state):
+        return load_state(sessions.get(), base_url, year, variables, state, api_key)
+
+    frames, failed = [], []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(fetch, year, state): (year, state) for year, state in jobs}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Fetching ACS Data"):
+            year, state = futures[future]
+            try:
+                results = future.result()
+            except Exception as e:
+                print(f"Failed request for year {year}, state {state}: {e}")
+                failed.append((year, state))
+                continue
+            frame = None
+            for variable, rows in results.items():
+                column = pd.DataFrame(rows, columns=["GEOID", variable]).set_index("GEOID")
+                frame = column if frame is None else frame.join(column, how="outer")
+            frame = frame.reset_index()
+            frame.insert(1, "Year", year)
+            frames.append(frame)
 
-# Census API URL
-base_url = "https://api.census.gov/data/2023/acs/acs5"
-params = {
-    "get": "NAME,B01003_001E",
-    "for": "tract:*",
-}
+    if failed:
+        raise RuntimeError(f"{len(failed)} ACS requests failed: {failed}")
 
-# List of state FIPS codes (01 = Alabama, 02 = Alaska, ..., 56 = Wyoming)
-state_fips_codes = [f"{i:02d}" for i in range(1, 57)]
+    df = pd.concat(frames, ignore_index=True)
+    df["GEOID"] = df["GEOID"].astype("string")
+    df["Year"] = df["Year"].astype("int16")
+    for variable in variables:
+        df[variable] = to_numeric(df[variable])
+    return df.sort_values(["Year", "GEOID"], ignore_index=True)
 
-# Collect data from all states
-all_data = []
-for state in state_fips_codes:
-    params["in"] = f"state:{state}"
-    resp = requests.get(base_url, params=params)
 
-    if resp.status_code == 200:
-        try:
-            data = resp.json()
-            all_data.extend(data[1:])  # Skip the header row
-        except requests.exceptions.JSONDecodeError:
-            print(f"JSON error for state {state}: {resp.text}")
-    else:
-        print(f"Failed request for state {state}: {resp.status_code} - {resp.text}")
+def main():
+    parser = argparse.ArgumentParser(description="Download tract-level ACS 5-year estimates from the Census API.")
+    parser.add_argument("--years", type=int, nargs="+", default=[2023], help="ACS 5-year vintages to fetch")
+    parser.add_argument("--variables", nargs="+", default=[POPULATION_VARIABLE], help="ACS variables to fetch")
+    parser.add_argument("--base-url", default=BASE_URL, help="Census API URL template with a {year} field")
+    parser.add_argument("--api-key", default=os.environ.get("CENSUS_API_KEY"), help="Census API key (optional)")
+    parser.add_argument("--workers", type=int, default=8, help="Number of concurrent requests")
+    parser.add_argument("--output", default=output_parquet, help="Typed output table (.parquet or .csv)")
+    parser.add_argument("--population-output", default=output_csv,
+                        help="Population table for calculate_county_elevs.py (.csv or .parquet)")
+    args = parser.parse_args()
 
-# Convert to DataFrame
-df = pd.DataFrame(all_data, columns=["NAME", "Total_Population", "State", "County", "Tract"])
+    df = fetch_acs(args.years, args.variables, base_url=args.base_url, workers=args.workers, api_key=args.api_key)
 
-# Create GEOID (Census Tract Identifier)
-df["GEOID"] = df["State"] + df["County"] + df["Tract"]
+    # Save the typed table
+    write_table(df, args.output)
+    print(f"✅ ACS data saved as '{args.output}'")
 
-# Select only GEOID and Total Population
-df = df[["GEOID", "Total_Population"]]
+    # Keep the population CSV used by calculate_county_elevs.py for the latest year
+    if POPULATION_VARIABLE in args.variables:
+        latest = df[df["Year"] == max(args.years)]
+        latest = latest[["GEOID", POPULATION_VARIABLE]].rename(columns={POPULATION_VARIABLE: "Total_Population"})
+        write_table(latest, args.population_output)
+        print(f"✅ Census population data saved as '{args.population_output}'")
 
-# Save to CSV
-df.to_csv("census_population.csv", index=False)
 
-print("✅ Census population data saved as 'census_population.csv'")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+import heapq
+import json
+import os
+import time
+
+from tqdm import tqdm
+
+# Stages timed for every polygon (and, with the tile-major strategy, every tile pass)
+STAGES = ("lookup", "read", "mask", "reduce", "output")
+
+# Upper bounds in seconds of the buckets of the per-record duration histogram
+SECONDS_BUCKETS = (0.01, 0.1, 1, 10, 60, 600)
+
+# Seconds between rewrites of a Prometheus text file while a run is going
+PROM_INTERVAL = 15
+
+
+# Function to tell whether a metrics path is a Prometheus text file rather than JSON lines
+def is_prometheus(path):
+    return path.lower().endswith(".prom")
+
+
+# Function to estimate the work of a polygon as the number of pixels under its bounding box
+def bbox_pixels(bounds, pixel_size):
+    left, bottom, right, top = bounds
+    return max(int((right - left) * (top - bottom) / pixel_size ** 2), 1)
+
+
+class WorkProgress:
+    """
+    Progress bar that advances by work instead of by polygon: each polygon
+    weighs the pixels under its bounding box, so a ZCTA in Manhattan moves
+    the bar (and its ETA) far less than one in rural Alaska. Polygons
+    answered without reading tiles (outside every tile, cached, from the
+    pyramid) weigh nothing. The polygon count is shown next to the bar.
+    """
+
+    def __init__(self, desc=None):
+        self.polygons = 0
+        self.done = 0
+        self._bar = tqdm(desc=desc, total=0, unit="px", unit_scale=True)
+
+    def add(self, polygons, work=0):
+        """Add ``polygons`` polygons weighing ``work`` pixels in total to the run."""
+        self.polygons += polygons
+        self._bar.total += work
+        self._show_polygons()
+
+    def advance(self, polygons, work=0):
+        """Mark ``polygons`` polygons weighing ``work`` pixels in total as finished."""
+        self.done += polygons
+        self._show_polygons()
+        self._bar.update(work)
+
+    def _show_polygons(self):
+        self._bar.set_postfix_str(f"{self.done}/{self.polygons} polygons", refresh=False)
+
+    def close(self):
+        self._bar.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class MetricsLog:
+    """
+    Collects the per-polygon measurements of a run: seconds spent in each of
+    ``STAGES``, bytes of pixel windows read, tiles touched and the bounding
+    box size in pixels. With the tile-major strategy, reads, masking and
+    reduction happen once per tile for all its polygons, so they are
+    recorded per tile pass and the polygon records only hold lookup and
+    output.
+
+    Records are appended to ``path`` as JSON lines, or, when ``path`` ends in
+    ``.prom``, aggregated into a Prometheus text file (rewritten every
+    ``PROM_INTERVAL`` seconds, e.g. for the node_exporter textfile
+    collector). Without ``path`` they are only summarised. The ``top_n``
+    slowest records are kept for ``report``.
+    """
+
+    def __init__(self, path=None, top_n=10):
+        self.path = path
+        self.top_n = top_n
+        self.records = {}
+        self.stage_seconds = dict.fromkeys(STAGES, 0.0)
+        self.bytes_read = 0
+        self.tiles_touched = 0
+        self.pixels = 0
+        self._buckets = {}
+        self._seconds = {}
+        self._slowest = []
+        self._file = open(path, "a") if path and not is_prometheus(path) else None
+        self._written = time.monotonic()
+
+    def record(self, record):
+        """
+        Add one measurement: a dict with ``kind`` ("polygon" or "tile"),
+        ``key``, the seconds of any of ``STAGES`` and optionally
+        ``bytes_read``, ``tiles`` and ``pixels``.
+        """
+        seconds = sum(record.get(stage, 0.0) for stage in STAGES)
+        record["seconds"] = seconds
+        kind = record["kind"]
+        self.records[kind] = self.records.get(kind, 0) + 1
+        for stage in STAGES:
+            self.stage_seconds[stage] += record.get(stage, 0.0)
+        self.bytes_read += record.get("bytes_read", 0)
+        if kind == "polygon":
+            self.tiles_touched += record.get("tiles", 0)
+            self.pixels += record.get("pixels", 0)
+
+        buckets = self._buckets.setdefault(kind, [0] * len(SECONDS_BUCKETS))
+        for i, bound in enumerate(SECONDS_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        self._seconds[kind] = self._seconds.get(kind, 0.0) + seconds
+
+        # Min-heap of the slowest records; the counter breaks ties without comparing dicts
+        entry = (seconds, sum(self.records.values()), record)
+        if len(self._slowest) < self.top_n:
+            heapq.heappush(self._slowest, entry)
+        elif self._slowest and seconds > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, entry)
+
+        if self._file is not None:
+            self._file.write(json.dumps(record) + "\n")
+        elif self.path and time.monotonic() - self._written >= PROM_INTERVAL:
+            self.write_prometheus()
+
+    def slowest(self):
+        """The ``top_n`` slowest records, slowest first."""
+        return [record for _, _, record in sorted(self._slowest, key=lambda entry: entry[:2], reverse=True)]
+
+    def write_prometheus(self):
+        lines = [
+            "# HELP zonal_records_total Polygons and tile passes measured.",
+            "# TYPE zonal_records_total counter",
+        ]
+        lines += [f'zonal_records_total{{kind="{kind}"}} {count}' for kind, count in self.records.items()]
+        lines += [
+            "# HELP zonal_stage_seconds_total Seconds spent in each stage.",
+            "# TYPE zonal_stage_seconds_total counter",
+        ]
+        lines += [f'zonal_stage_seconds_total{{stage="{stage}"}} {seconds}'
+                  for stage, seconds in self.stage_seconds.items()]
+        lines += [
+            "# HELP zonal_bytes_read_total Bytes of pixel windows read from tiles.",
+            "# TYPE zonal_bytes_read_total counter",
+            f"zonal_bytes_read_total {self.bytes_read}",
+            "# HELP zonal_tiles_touched_total Tiles intersected, summed over polygons.",
+            "# TYPE zonal_tiles_touched_total counter",
+            f"zonal_tiles_touched_total {self.tiles_touched}",
+            "# HELP zonal_bbox_pixels_total Pixels under the bounding boxes of the polygons measured.",
+            "# TYPE zonal_bbox_pixels_total counter",
+            f"zonal_bbox_pixels_total {self.pixels}",
+            "# HELP zonal_record_seconds Seconds per polygon or tile pass.",
+            "# TYPE zonal_record_seconds histogram",
+        ]
+        for kind, buckets in self._buckets.items():
+            for bound, count in zip(SECONDS_BUCKETS, buckets):
+                lines.append(f'zonal_record_seconds_bucket{{kind="{kind}",le="{bound}"}} {count}')
+            lines.append(f'zonal_record_seconds_bucket{{kind="{kind}",le="+Inf"}} {self.records[kind]}')
+            lines.append(f'zonal_record_seconds_sum{{kind="{kind}"}} {self._seconds[kind]}')
+            lines.append(f'zonal_record_seconds_count{{kind="{kind}"}} {self.records[kind]}')
+
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+        self._written = time.monotonic()
+
+    def report(self):
+        """Summary of where the time went and the slowest records, as text."""
+        if not self.records:
+            return "No polygons measured"
+        total = sum(self.stage_seconds.values()) or 1.0
+        counts = ", ".join(f"{count} {kind}s" for kind, count in self.records.items())
+        stages = ", ".join(f"{stage} {seconds:.1f}s ({seconds / total:.0%})"
+                           for stage, seconds in self.stage_seconds.items())
+        lines = [f"Measured {counts}: {stages}; {self.bytes_read / 1e6:.1f} MB read"]
+        slowest = self.slowest()
+        if slowest:
+            lines.append(f"Slowest {len(slowest)}:")
+        for record in slowest:
+            stages = ", ".join(f"{stage} {record[stage]:.2f}s" for stage in STAGES if record.get(stage))
+            details = "".join(f", {record[field]} {field}" for field in ("tiles", "pixels", "polygons")
+                              if field in record)
+            lines.append(f"  {record['kind']} {record['key']}: {record['seconds']:.2f}s ({stages}{details})")
+        return "\n".join(lines)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        elif self.path:
+            self.write_prometheus()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
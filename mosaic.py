@@ -0,0 +1,194 @@
+import math
+from collections import OrderedDict
+
+import numpy as np
+import rasterio
+import shapely
+from affine import Affine
+from rasterio.features import geometry_mask
+from rasterio.windows import Window
+
+# Side in pixels of the blocks polygon masks are built from
+MASK_BLOCK = 256
+
+# Radius of the sphere with the same surface area as the GRS80/WGS84 ellipsoid, in metres
+EARTH_RADIUS = 6371007.181
+
+
+class DatasetPool:
+    """
+    LRU pool of open rasterio datasets, so consecutive reads from the same
+    tile reuse its file handle and GDAL's block cache.
+    """
+
+    def __init__(self, max_open=32):
+        self.max_open = max_open
+        self._datasets = OrderedDict()
+
+    def get(self, path):
+        src = self._datasets.pop(path, None)
+        if src is None:
+            src = rasterio.open(path)
+        self._datasets[path] = src
+        while len(self._datasets) > self.max_open:
+            _, oldest = self._datasets.popitem(last=False)
+            oldest.close()
+        return src
+
+    def read(self, tile, window):
+        """Read ``window`` of the first band of ``tile`` (a ``TileInfo``)."""
+        return self.get(tile.path).read(1, window=window)
+
+    def close(self):
+        while self._datasets:
+            _, src = self._datasets.popitem()
+            src.close()
+
+
+def valid_data_mask(data, nodata):
+    """
+    Flag the pixels of ``data`` that hold a value. Besides pixels equal to
+    ``nodata`` (None when the tile declares none), NaN is never a value in a
+    floating-point tile, whatever its declared nodata.
+    """
+    floating = np.issubdtype(data.dtype, np.floating)
+    if nodata is None or np.isnan(nodata):
+        return ~np.isnan(data) if floating else np.ones(data.shape, dtype=bool)
+    valid = data != nodata
+    if floating:
+        valid &= ~np.isnan(data)
+    return valid
+
+
+# Function to snap a bounding box outwards onto the pixel grid of a tile
+def snap_to_grid(bounds, transform):
+    res_x, res_y = transform.a, -transform.e
+    col_start = math.floor((bounds[0] - transform.c) / res_x)
+    col_stop = math.ceil((bounds[2] - transform.c) / res_x)
+    row_start = math.floor((transform.f - bounds[3]) / res_y)
+    row_stop = math.ceil((transform.f - bounds[1]) / res_y)
+    window_transform = transform * Affine.translation(col_start, row_start)
+    return window_transform, (max(row_stop - row_start, 0), max(col_stop - col_start, 0))
+
+
+# Function to find the window of a tile under a bounding box, snapped outwards to its pixels
+def tile_window(tile, bounds):
+    transform, (rows, cols) = snap_to_grid(bounds, tile.affine)
+    col_offset = round((transform.c - tile.affine.c) / tile.affine.a)
+    row_offset = round((transform.f - tile.affine.f) / tile.affine.e)
+    col_start, col_stop = max(col_offset, 0), min(col_offset + cols, tile.width)
+    row_start, row_stop = max(row_offset, 0), min(row_offset + rows, tile.height)
+    if col_start >= col_stop or row_start >= row_stop:
+        return None, None
+    window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+    return window, tile.affine * Affine.translation(col_start, row_start)
+
+
+def read_mosaic(tiles, bounds, datasets=None):
+    """
+    Read the pixels under ``bounds`` from every tile in ``tiles`` into a single
+    in-memory array on the pixel grid of the first tile.
+
+    Only the window of each tile that falls inside ``bounds`` is read. Pixels
+    covered by more than one tile (the USGS tiles overlap by a few pixels) take
+    the first valid value. Returns ``(data, valid, transform)`` where ``valid``
+    flags the pixels that hold data from some tile. Pass a ``DatasetPool`` as
+    ``datasets`` to keep the tiles open between calls.
+
+    A window read whole from one tile, with no missing pixels, is returned
+    as read rather than copied into a new array (with a ``SharedBlockCache``,
+    a read-only view of the shared copy of the tile).
+    """
+    reference = tiles[0]
+    transform, shape = snap_to_grid(bounds, reference.affine)
+    data = np.zeros(shape, dtype=reference.dtype)
+    filled = np.zeros(shape, dtype=bool)
+    filled_any = False
+
+    for tile in tiles:
+        tile_transform = tile.affine
+        if not (math.isclose(tile_transform.a, transform.a) and math.isclose(tile_transform.e, transform.e)):
+            raise ValueError(f"{tile.path} does not share the pixel size of {reference.path}")
+
+        # Offset of the tile's top-left pixel in the mosaic grid
+        col_offset = round((tile_transform.c - transform.c) / transform.a)
+        row_offset = round((tile_transform.f - transform.f) / transform.e)
+        col_start, col_stop = max(col_offset, 0), min(col_offset + tile.width, shape[1])
+        row_start, row_stop = max(row_offset, 0), min(row_offset + tile.height, shape[0])
+        if col_start >= col_stop or row_start >= row_stop:
+            continue
+
+        window = Window(col_start - col_offset, row_start - row_offset,
+                        col_stop - col_start, row_stop - row_start)
+        if datasets is not None:
+            block = datasets.read(tile, window)
+        else:
+            with rasterio.open(tile.path) as src:
+                block = src.read(1, window=window)
+
+        valid = valid_data_mask(block, tile.nodata)
+        if block.shape == shape and not filled_any and valid.all():
+            return block, valid, transform
+        filled_any = True
+        target = (slice(row_start, row_stop), slice(col_start, col_stop))
+        valid &= ~filled[target]
+        data[target][valid] = block[valid]
+        filled[target] |= valid
+
+    return data, filled, transform
+
+
+def pixel_row_areas(transform, rows, geographic, row_offset=0):
+    """
+    Ground area in m² of one pixel in each of ``rows`` rows of a north-up grid,
+    starting ``row_offset`` rows below the origin of ``transform``. Pixels of a
+    geographic (degree) grid shrink towards the poles; projected grids are
+    assumed to be in metres.
+    """
+    if not geographic:
+        return np.full(rows, abs(transform.a * transform.e))
+    top = transform.f + transform.e * (row_offset + np.arange(rows))
+    bottom = top + transform.e
+    width = math.radians(abs(transform.a))
+    return EARTH_RADIUS ** 2 * width * np.abs(np.sin(np.radians(top)) - np.sin(np.radians(bottom)))
+
+
+def pixel_height(transform, geographic):
+    """Height in metres of the pixels of a north-up grid (see ``pixel_row_areas``)."""
+    if not geographic:
+        return abs(transform.e)
+    return EARTH_RADIUS * math.radians(abs(transform.e))
+
+
+def polygon_mask(geometry, shape, transform):
+    """
+    Rasterize a polygon onto a window: True for the pixels whose centres fall
+    inside it. Large windows are handled in ``MASK_BLOCK`` blocks; using a
+    prepared geometry, blocks entirely inside the polygon are filled without
+    rasterizing, blocks outside it are skipped, and only the boundary blocks
+    are rasterized, each with the polygon clipped to the block.
+    """
+    rows, cols = shape
+    if rows == 0 or cols == 0:
+        return np.zeros(shape, dtype=bool)
+    if rows <= MASK_BLOCK and cols <= MASK_BLOCK:
+        return geometry_mask([geometry], out_shape=shape, transform=transform, invert=True)
+
+    shapely.prepare(geometry)
+    inside = np.zeros(shape, dtype=bool)
+    for row in range(0, rows, MASK_BLOCK):
+        for col in range(0, cols, MASK_BLOCK):
+            block_shape = (min(MASK_BLOCK, rows - row), min(MASK_BLOCK, cols - col))
+            block_transform = transform * Affine.translation(col, row)
+            left, top = block_transform * (0, 0)
+            right, bottom = block_transform * (block_shape[1], block_shape[0])
+            block = shapely.box(left, bottom, right, top)
+            target = (slice(row, row + block_shape[0]), slice(col, col + block_shape[1]))
+            if geometry.contains(block):
+                inside[target] = True
+            elif geometry.intersects(block):
+                clipped = shapely.clip_by_rect(geometry, *block.bounds)
+                if not clipped.is_empty:
+                    inside[target] = geometry_mask([clipped], out_shape=block_shape, transform=block_transform,
+                                                   invert=True)
+    return inside
@@ -0,0 +1,274 @@
+"""
+Elevation at arbitrary points (addresses, clinics, ...) from the tiles in
+``elevation_tiles``.
+
+Usable as a library::
+
+    from point_lookup import ElevationLookup
+    with ElevationLookup.open("elevation_tiles") as lookup:
+        elevations = lookup.sample(lons, lats)
+
+as a local HTTP service::
+
+    python point_lookup.py serve --port 8080
+    curl "http://localhost:8080/elevation?lat=39.74&lon=-104.99"
+    curl -d '{"lats": [39.74, 40.01], "lons": [-104.99, -105.27]}' http://localhost:8080/elevation
+
+or to measure lookup latency and throughput::
+
+    python point_lookup.py benchmark --points 10000
+
+Coordinates are longitude/latitude in the CRS of the tiles (NAD83 for the
+USGS tiles). Points outside every tile or on nodata pixels get NaN (null in
+JSON).
+"""
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+from rasterio.windows import Window
+
+from mosaic import DatasetPool, valid_data_mask
+from tile_catalog import TileCatalog
+
+# Get the directory where the script is located
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+class BlockCache:
+    """LRU cache of decoded raster blocks, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._blocks = OrderedDict()
+
+    def get(self, key, read):
+        """Return the block stored under ``key``, calling ``read()`` to load it on a miss."""
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            return block
+        block = read()
+        self._blocks[key] = block
+        self.nbytes += block.nbytes
+        while self.nbytes > self.max_bytes and len(self._blocks) > 1:
+            _, oldest = self._blocks.popitem(last=False)
+            self.nbytes -= oldest.nbytes
+        return block
+
+
+class ElevationLookup:
+    """
+    Point elevation sampler over a ``TileCatalog``.
+
+    Points are assigned to tiles with the catalog's spatial index, then
+    grouped by the internal block of the tile they fall in, so every block
+    is read (and decompressed) once per batch; decoded blocks stay in an
+    LRU ``BlockCache`` for later calls. Datasets are kept open in a
+    ``DatasetPool``. Calls are serialised with a lock, so one lookup can be
+    shared by the threads of the HTTP server.
+    """
+
+    def __init__(self, catalog, max_open=32, cache_bytes=256 * 2 ** 20):
+        self.catalog = catalog
+        self.datasets = DatasetPool(max_open)
+        self.blocks = BlockCache(cache_bytes)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, elevation_dir, **kwargs):
+        return cls(TileCatalog.load(elevation_dir), **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _block(self, tile, src, block_row, block_col):
+        block_rows, block_cols = src.block_shapes[0]
+
+        def read():
+            window = Window(block_col * block_cols, block_row * block_rows,
+                            min(block_cols, tile.width - block_col * block_cols),
+                            min(block_rows, tile.height - block_row * block_rows))
+            data = src.read(1, window=window)
+            return np.where(valid_data_mask(data, tile.nodata), data.astype(np.float32), np.float32(np.nan))
+
+        return self.blocks.get((tile.path, block_row, block_col), read)
+
+    def sample(self, xs, ys):
+        """Elevation at each point of ``xs`` (longitudes) and ``ys`` (latitudes), as a float64 array."""
+        xs = np.asarray(xs, dtype=np.float64).ravel()
+        ys = np.asarray(ys, dtype=np.float64).ravel()
+        values = np.full(len(xs), np.nan)
+
+        with self._lock:
+            located = self.catalog.locate(xs, ys)
+            for tile_index in np.unique(located[located >= 0]):
+                tile = self.catalog.tiles[tile_index]
+                selected = np.flatnonzero(located == tile_index)
+                transform = tile.affine
+                # Points on the right or bottom edge of a tile belong to its last pixel
+                cols = np.clip(np.floor((xs[selected] - transform.c) / transform.a).astype(np.int64),
+                               0, tile.width - 1)
+                rows = np.clip(np.floor((ys[selected] - transform.f) / transform.e).astype(np.int64),
+                               0, tile.height - 1)
+
+                src = self.datasets.get(tile.path)
+                block_rows, block_cols = src.block_shapes[0]
+                blocks_per_row = -(-tile.width // block_cols)
+                block_ids = (rows // block_rows) * blocks_per_row + cols // block_cols
+
+                # Sort the points by block and read each block once
+                order = np.argsort(block_ids, kind="stable")
+                unique_ids, unique_starts = np.unique(block_ids[order], return_index=True)
+                for block_id, group in zip(unique_ids, np.split(order, unique_starts[1:])):
+                    block_row, block_col = divmod(int(block_id), blocks_per_row)
+                    block = self._block(tile, src, block_row, block_col)
+                    values[selected[group]] = block[rows[group] - block_row * block_rows,
+                                                    cols[group] - block_col * block_cols]
+        return values
+
+    def sample_point(self, x, y):
+        return float(self.sample([x], [y])[0])
+
+    def close(self):
+        with self._lock:
+            self.datasets.close()
+
+
+# Function to turn NaN into JSON null
+def _json_value(value):
+    return None if math.isnan(value) else float(value)
+
+
+class _LookupHandler(BaseHTTPRequestHandler):
+    """
+    ``GET /elevation?lat=..&lon=..`` for one point, ``POST /elevation`` with
+    ``{"lats": [..], "lons": [..]}`` for a batch.
+    """
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != "/elevation":
+            return self._send(404, {"error": f"unknown path {url.path}"})
+        query = parse_qs(url.query)
+        try:
+            lat, lon = float(query["lat"][0]), float(query["lon"][0])
+        except (KeyError, ValueError):
+            return self._send(400, {"error": "expected numeric lat and lon query parameters"})
+        elevation = self.server.lookup.sample_point(lon, lat)
+        self._send(200, {"lat": lat, "lon": lon, "elevation": _json_value(elevation)})
+
+    def do_POST(self):
+        if urlsplit(self.path).path != "/elevation":
+            return self._send(404, {"error": f"unknown path {self.path}"})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            lats = np.asarray(request["lats"], dtype=np.float64)
+            lons = np.asarray(request["lons"], dtype=np.float64)
+            if lats.shape != lons.shape:
+                raise ValueError("lats and lons differ in length")
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send(400, {"error": f"expected a JSON body with equal-length lats and lons - {e}"})
+        elevations = self.server.lookup.sample(lons, lats)
+        self._send(200, {"elevations": [_json_value(value) for value in elevations]})
+
+
+def serve(lookup, host="127.0.0.1", port=8080):
+    """Serve ``lookup`` over HTTP until interrupted."""
+    server = ThreadingHTTPServer((host, port), _LookupHandler)
+    server.lookup = lookup
+    print(f"Serving elevations on http://{host}:{port}/elevation")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# Function to draw random points inside randomly chosen tiles
+def random_points(catalog, n, seed=0):
+    rng = np.random.default_rng(seed)
+    bounds = np.array([tile.bounds for tile in catalog.tiles])[rng.integers(len(catalog.tiles), size=n)]
+    xs = rng.uniform(bounds[:, 0], bounds[:, 2])
+    ys = rng.uniform(bounds[:, 1], bounds[:, 3])
+    return xs, ys
+
+
+def benchmark(lookup, n=10000, seed=0):
+    """
+    Time ``n`` single-point lookups (p50/p99 latency) and one batch of ``n``
+    other points (points/sec), at random locations within the tiles.
+    Returns a dict of the measurements.
+    """
+    xs, ys = random_points(lookup.catalog, n, seed)
+    latencies = np.empty(n)
+    for i in range(n):
+        start = time.perf_counter()
+        lookup.sample_point(xs[i], ys[i])
+        latencies[i] = time.perf_counter() - start
+
+    xs, ys = random_points(lookup.catalog, n, seed + 1)
+    start = time.perf_counter()
+    lookup.sample(xs, ys)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "points": n,
+        "p50_ms": float(np.percentile(latencies, 50) * 1e3),
+        "p99_ms": float(np.percentile(latencies, 99) * 1e3),
+        "single_points_per_sec": n / latencies.sum(),
+        "batch_points_per_sec": n / batch_seconds,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up elevations at points.")
+    parser.add_argument("--elevation-dir", default=os.path.join(script_dir, "elevation_tiles"),
+                        help="Directory of elevation GeoTIFF tiles")
+    parser.add_argument("--cache-mb", type=float, default=256, help="Size of the decoded block cache in MB")
+    commands = parser.add_subparsers(dest="command", required=True)
+    serve_parser = commands.add_parser("serve", help="Serve elevations over HTTP")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8080)
+    sample_parser = commands.add_parser("sample", help="Print the elevation at one point")
+    sample_parser.add_argument("lat", type=float)
+    sample_parser.add_argument("lon", type=float)
+    benchmark_parser = commands.add_parser("benchmark", help="Measure lookup latency and throughput")
+    benchmark_parser.add_argument("--points", type=int, default=10000)
+    benchmark_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    with ElevationLookup.open(args.elevation_dir, cache_bytes=int(args.cache_mb * 2 ** 20)) as lookup:
+        if args.command == "serve":
+            serve(lookup, args.host, args.port)
+        elif args.command == "sample":
+            print(lookup.sample_point(args.lon, args.lat))
+        else:
+            results = benchmark(lookup, args.points, args.seed)
+            print(f"{results['points']} points: p50 {results['p50_ms']:.3f} ms, p99 {results['p99_ms']:.3f} ms, "
+                  f"{results['single_points_per_sec']:.0f} points/sec one at a time, "
+                  f"{results['batch_points_per_sec']:.0f} points/sec in one batch")
+
+
+if __name__ == "__main__":
+    main()
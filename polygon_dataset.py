@@ -0,0 +1,61 @@
+import glob
+import json
+import os
+
+import geopandas as gpd
+import pyarrow.parquet as pq
+
+from table_io import is_parquet
+
+PARTITION_FILE = "part.parquet"
+
+
+# Function to locate one partition of a Hive-style dataset (e.g. STATEFP=06/part.parquet)
+def partition_path(dataset_dir, column, value):
+    return os.path.join(dataset_dir, f"{column}={value}", PARTITION_FILE)
+
+
+def write_partition(polygons, dataset_dir, column, value):
+    """
+    Write the GeoDataFrame ``polygons`` as the ``column=value`` partition of a
+    GeoParquet dataset, replacing any earlier version of that partition. The
+    file is written under a temporary name first, so an interrupted write
+    never leaves a partial partition behind.
+    """
+    path = partition_path(dataset_dir, column, value)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    polygons.to_parquet(tmp_path, index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+# Function to list the partition files of a dataset in a stable order
+def list_partitions(dataset_dir):
+    return sorted(glob.glob(os.path.join(dataset_dir, "*", PARTITION_FILE)))
+
+
+# Function to read one GeoParquet file, loading only the given attribute columns
+def _read_geoparquet(path, columns=None):
+    if columns is not None:
+        geometry_column = json.loads(pq.read_schema(path).metadata[b"geo"])["primary_column"]
+        columns = list(columns) + [geometry_column]
+    return gpd.read_parquet(path, columns=columns)
+
+
+def iter_partitions(path, columns=None):
+    """
+    Yield a polygon layer as a sequence of GeoDataFrames. A partitioned
+    GeoParquet dataset (a directory written by ``write_partition``) is read
+    one partition at a time, so memory is bounded by the largest partition;
+    a single GeoParquet file or any other layer GDAL can open is yielded
+    whole. ``columns`` limits the attribute columns read (the geometry is
+    always included).
+    """
+    if os.path.isdir(path):
+        for partition in list_partitions(path):
+            yield _read_geoparquet(partition, columns)
+    elif is_parquet(path):
+        yield _read_geoparquet(path, columns)
+    else:
+        yield gpd.read_file(path, columns=columns)
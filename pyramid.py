@@ -0,0 +1,251 @@
+"""
+Reduced-resolution pyramid of the elevation tiles, for summarising large
+polygons without reading every full-resolution pixel.
+
+Each level holds, per block of ``factor`` x ``factor`` pixels, the same
+additive partial sums as ``ElevationStats`` (count, sum, sum of squares,
+ground area, area-weighted sum) plus the block min/max. A polygon summed
+over the blocks whose centres fall inside it differs from the exact result
+only through the blocks cut by its boundary, whose share of the polygon is
+at most ``perimeter * block width / area``. ``Pyramid.choose_factor`` picks
+the coarsest level that keeps this share under a tolerance.
+
+Build the pyramid once after downloading the tiles::
+
+    python pyramid.py --elevation-dir elevation_tiles
+"""
+import argparse
+import math
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import rasterio
+from affine import Affine
+from rasterio.windows import Window
+from tqdm import tqdm
+
+from elevation_stats import ElevationStats
+from mosaic import pixel_row_areas, polygon_mask, valid_data_mask
+from result_cache import tile_identity
+from tile_catalog import TileCatalog
+from tile_major import STRIP_BAND_ROWS, claimed_slices
+
+# Block sizes in pixels of the pyramid levels, finest first. Each level is
+# aggregated from the one before, so every factor must divide the next.
+FACTORS = (8, 32, 128)
+
+# Per-block arrays stored for every level, and their dtypes
+FIELDS = {
+    "count": np.int32,
+    "total": np.float64,
+    "total_sq": np.float64,
+    "minimum": np.float32,
+    "maximum": np.float32,
+    "area": np.float64,
+    "area_total": np.float64,
+}
+
+
+# Function to reduce every factor x factor block of a 2-D array
+def _block_reduce(values, factor, func):
+    rows, cols = values.shape
+    return func(values.reshape(rows // factor, factor, cols // factor, factor), axis=(1, 3))
+
+
+# Function to aggregate the block arrays of one level into the next coarser level
+def _coarsen(level, factor):
+    return {
+        field: _block_reduce(values, factor,
+                             np.min if field == "minimum" else np.max if field == "maximum" else np.sum)
+        for field, values in level.items()
+    }
+
+
+def build_tile_pyramid(tile, claimed_bounds, path, factors=FACTORS):
+    """
+    Write the pyramid of one tile to ``path`` (an ``.npz`` file). Pixels
+    inside ``claimed_bounds`` are left out, as in the tile-major strategy, so
+    the pyramids of overlapping tiles never count a pixel twice.
+    """
+    coarsest = factors[-1]
+    band_rows = max(STRIP_BAND_ROWS // coarsest, 1) * coarsest
+    padded_cols = -(-tile.width // coarsest) * coarsest
+    skip = claimed_slices(claimed_bounds, tile.affine, (tile.height, tile.width))
+    bands = {factor: {field: [] for field in FIELDS} for factor in factors}
+
+    with rasterio.open(tile.path) as src:
+        for row in range(0, tile.height, band_rows):
+            rows = min(band_rows, tile.height - row)
+            data = src.read(1, window=Window(0, row, tile.width, rows))
+            valid = valid_data_mask(data, tile.nodata)
+            for row_start, row_stop, col_start, col_stop in skip:
+                valid[max(row_start - row, 0):max(row_stop - row, 0), col_start:col_stop] = False
+            areas = np.broadcast_to(pixel_row_areas(tile.affine, rows, tile.geographic, row)[:, None], data.shape)
+
+            # Pad the band to whole blocks of the coarsest level
+            pad = ((0, -(-rows // coarsest) * coarsest - rows), (0, padded_cols - tile.width))
+            valid = np.pad(valid, pad)
+            values = np.where(valid, np.pad(data.astype(np.float64), pad), 0.0)
+            areas = np.where(valid, np.pad(areas, pad), 0.0)
+
+            level = {
+                "count": _block_reduce(valid, factors[0], np.sum),
+                "total": _block_reduce(values, factors[0], np.sum),
+                "total_sq": _block_reduce(values * values, factors[0], np.sum),
+                "minimum": _block_reduce(np.where(valid, values, math.inf), factors[0], np.min),
+                "maximum": _block_reduce(np.where(valid, values, -math.inf), factors[0], np.max),
+                "area": _block_reduce(areas, factors[0], np.sum),
+                "area_total": _block_reduce(values * areas, factors[0], np.sum),
+            }
+            for i, factor in enumerate(factors):
+                if i:
+                    level = _coarsen(level, factor // factors[i - 1])
+                for field, blocks in level.items():
+                    bands[factor][field].append(blocks)
+
+    arrays = {
+        f"{field}_{factor}": np.concatenate(bands[factor][field]).astype(dtype)
+        for factor in factors for field, dtype in FIELDS.items()
+    }
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, identity=np.array(tile_identity(tile)), factors=np.array(factors), **arrays)
+    os.replace(tmp_path, path)
+    return path
+
+
+class Pyramid:
+    """
+    Reader of the pyramid files in ``directory``, keeping the most recently
+    used ``max_loaded`` (tile, level) arrays in memory. Levels of tiles that
+    changed on disk since the pyramid was built are treated as missing.
+    """
+
+    def __init__(self, directory, max_loaded=64):
+        self.directory = directory
+        self.max_loaded = max_loaded
+        self._levels = OrderedDict()
+
+    @staticmethod
+    def default_path(elevation_dir):
+        return os.path.normpath(elevation_dir) + "_pyramid"
+
+    def path(self, tile):
+        return os.path.join(self.directory, tile.name + ".npz")
+
+    def is_current(self, tile):
+        """Whether the pyramid of ``tile`` exists and was built from its current version."""
+        try:
+            with np.load(self.path(tile)) as npz:
+                return npz["identity"].item() == tile_identity(tile)
+        except (OSError, KeyError, ValueError):
+            return False
+
+    def _level(self, tile, factor):
+        key = (tile.path, factor)
+        if key in self._levels:
+            self._levels.move_to_end(key)
+            return self._levels[key]
+
+        level = None
+        if self.is_current(tile):
+            with np.load(self.path(tile)) as npz:
+                if factor in npz["factors"]:
+                    level = {field: npz[f"{field}_{factor}"] for field in FIELDS}
+        self._levels[key] = level
+        while len(self._levels) > self.max_loaded:
+            self._levels.popitem(last=False)
+        return level
+
+    @staticmethod
+    def choose_factor(geometry, tiles, tolerance):
+        """
+        The coarsest level whose boundary blocks make up at most
+        ``tolerance`` of ``geometry`` (``perimeter * block width / area``),
+        or None when even the finest level is too coarse.
+        """
+        if geometry.area == 0:
+            return None
+        pixel = max(abs(tiles[0].affine.a), abs(tiles[0].affine.e))
+        for factor in reversed(FACTORS):
+            if geometry.length * pixel * factor / geometry.area <= tolerance:
+                return factor
+        return None
+
+    def query(self, geometry, tiles, factor):
+        """
+        Summarise ``geometry`` from the ``factor`` level of every tile in
+        ``tiles``, counting the blocks whose centres fall inside it. Returns
+        None when a tile has no current pyramid.
+        """
+        stats = ElevationStats()
+        left, bottom, right, top = geometry.bounds
+        for tile in tiles:
+            level = self._level(tile, factor)
+            if level is None:
+                return None
+
+            transform = tile.affine * Affine.scale(factor)
+            rows, cols = level["count"].shape
+            col_start = max(math.floor((left - transform.c) / transform.a), 0)
+            col_stop = min(math.ceil((right - transform.c) / transform.a), cols)
+            row_start = max(math.floor((transform.f - top) / -transform.e), 0)
+            row_stop = min(math.ceil((transform.f - bottom) / -transform.e), rows)
+            if col_start >= col_stop or row_start >= row_stop:
+                continue
+
+            window = (slice(row_start, row_stop), slice(col_start, col_stop))
+            inside = polygon_mask(geometry, (row_stop - row_start, col_stop - col_start),
+                                  transform * Affine.translation(col_start, row_start))
+            inside &= level["count"][window] > 0
+            if not inside.any():
+                continue
+            blocks = {field: values[window][inside] for field, values in level.items()}
+            stats.merge(ElevationStats(
+                int(blocks["count"].sum()), float(blocks["total"].sum()), float(blocks["total_sq"].sum()),
+                float(blocks["minimum"].min()), float(blocks["maximum"].max()),
+                float(blocks["area"].sum()), float(blocks["area_total"].sum()),
+            ))
+        return stats
+
+
+def build_pyramid(catalog, directory, workers=1):
+    """
+    Build the pyramid of every tile in ``catalog`` into ``directory`` on
+    ``workers`` processes, skipping tiles whose pyramid is already current.
+    Returns the number of tiles built.
+    """
+    os.makedirs(directory, exist_ok=True)
+    pyramid = Pyramid(directory)
+    tasks = [(tile, catalog.claimed_bounds(tile.path), pyramid.path(tile))
+             for tile in catalog.tiles if not pyramid.is_current(tile)]
+    if workers == 1:
+        for task in tqdm(tasks, desc="Building Pyramid"):
+            build_tile_pyramid(*task)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(build_tile_pyramid, *task) for task in tasks]
+            for future in tqdm(futures, desc="Building Pyramid"):
+                future.result()
+    return len(tasks)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the reduced-resolution pyramid of the elevation tiles.")
+    parser.add_argument("--elevation-dir", default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                                "elevation_tiles"),
+                        help="Directory of elevation GeoTIFF tiles")
+    parser.add_argument("--pyramid-dir", help="Output directory (default: <elevation-dir>_pyramid)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPU cores)")
+    args = parser.parse_args(argv)
+
+    catalog = TileCatalog.load(args.elevation_dir)
+    built = build_pyramid(catalog, args.pyramid_dir or Pyramid.default_path(args.elevation_dir), args.workers)
+    print(f"Built the pyramid of {built} of {len(catalog)} tiles")
+
+
+if __name__ == "__main__":
+    main()
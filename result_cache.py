@@ -0,0 +1,93 @@
+import hashlib
+import os
+import sqlite3
+
+import shapely
+
+from elevation_stats import ElevationStats
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stats (
+    key TEXT PRIMARY KEY,
+    count INTEGER,
+    total REAL,
+    total_sq REAL,
+    minimum REAL,
+    maximum REAL,
+    area REAL,
+    area_total REAL
+)
+"""
+
+
+# Function to identify a tile by its name and on-disk version
+def tile_identity(tile):
+    return f"{tile.name}|{tile.size}|{tile.mtime!r}"
+
+
+def result_key(geometry, tiles, strategy):
+    """
+    Content address of a polygon's result: the hash of its normalized WKB, the
+    identities of the tiles it intersects and the merge strategy. Any change to
+    the geometry or to one of its tiles gives a new key.
+    """
+    digest = hashlib.sha256(shapely.to_wkb(shapely.normalize(geometry)))
+    for identity in sorted(tile_identity(tile) for tile in tiles):
+        digest.update(identity.encode())
+    digest.update(strategy.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent content-addressed cache of polygon summaries, shared by every
+    geography and vintage computed over the same elevation tiles.
+    """
+
+    def __init__(self, path, batch_size=256):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(SCHEMA)
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(stats)")}
+        for column in ("area", "area_total"):
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE stats ADD COLUMN {column} REAL")
+        self._conn.commit()
+
+    @staticmethod
+    def default_path(elevation_dir):
+        return os.path.normpath(elevation_dir) + "_results.sqlite"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get(self, key):
+        row = self._conn.execute(
+            "SELECT count, total, total_sq, minimum, maximum, area, area_total FROM stats WHERE key = ?",
+            (key,)).fetchone()
+        # Entries cached before pixel areas were tracked are recomputed
+        if row is None or row[5] is None:
+            return None
+        return ElevationStats(*row)
+
+    def put(self, key, stats):
+        self._pending.append((key, stats.count, stats.total, stats.total_sq, stats.minimum, stats.maximum,
+                              stats.area, stats.area_total))
+        if len(self._pending) >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        if self._pending:
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def close(self):
+        self.commit()
+        self._conn.close()
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+# Census GEOIDs nest by prefix: SSCCCTTTTTT (state, county, tract)
+GEOID_LEVELS = [
+    ("county", 5),
+    ("state", 2),
+    ("nation", 0),
+]
+
+NATION_KEY = "US"
+
+# Additive partial sums written by zonal_stats.py, and their short names here
+PIXEL_SUM_COLUMNS = {
+    "Pixel Count": "count",
+    "Elevation Sum": "total",
+    "Elevation Sum Squares": "total_sq",
+    "Area m2": "area",
+    "Area Elevation Sum": "area_total",
+}
+
+
+# Function to sum columns per group, optionally leaving a group's total unknown
+# when any of its members is unknown
+def _group_sums(frame, keys, propagate_missing):
+    sums = frame.groupby(keys, sort=True).sum()
+    if propagate_missing:
+        sums = sums.mask(frame.isna().groupby(keys, sort=True).any())
+    return sums.rename_axis("key")
+
+
+def sum_rollup(data, id_column, columns, levels=GEOID_LEVELS, propagate_missing=False):
+    """
+    Sums of ``columns`` over every level of a GEOID hierarchy.
+
+    Each level's key is a prefix of ``id_column`` (e.g. the first five
+    characters of a tract GEOID are its county FIPS). Sums are taken with a
+    vectorized groupby at the finest level and re-aggregated from there, so
+    every level is computed in one pass over ``data``. With
+    ``propagate_missing``, a group containing a missing value gets a missing
+    sum instead of a silently partial one. Returns ``{level: DataFrame}`` with
+    a ``key`` column followed by ``columns``.
+    """
+    current = data[list(columns)].astype(float)
+    current.index = pd.Index(data[id_column].astype(str).to_numpy(), name="key")
+
+    results = {}
+    for level, prefix_length in levels:
+        keys = current.index.str[:prefix_length] if prefix_length else np.full(len(current), NATION_KEY)
+        current = _group_sums(current, keys, propagate_missing)
+        results[level] = current.reset_index()
+    return results
+
+
+def weighted_rollup(data, id_column, value_column, weight_column, levels=GEOID_LEVELS):
+    """
+    Weighted means of ``value_column`` over every level of a GEOID hierarchy.
+    Returns ``{level: DataFrame}`` with columns ``key``, ``value`` and ``weight``.
+    """
+    weights = data[weight_column].astype(float)
+    frame = pd.DataFrame({
+        id_column: data[id_column],
+        "weighted": data[value_column].astype(float) * weights,
+        "weight": weights,
+    })
+    return {
+        level: pd.DataFrame({
+            "key": sums["key"],
+            "value": sums["weighted"] / sums["weight"],
+            "weight": sums["weight"],
+        })
+        for level, sums in sum_rollup(frame, id_column, ["weighted", "weight"], levels).items()
+    }
+
+
+# Function to turn summed pixel partials into elevation statistics
+def summarize_pixel_sums(sums):
+    count = sums["count"]
+    mean = sums["total"] / count
+    variance = (sums["total_sq"] / count - mean ** 2).clip(lower=0)
+    return pd.DataFrame({
+        "key": sums["key"],
+        "Pixel_Count": count,
+        "Pixel_Mean_Elevation": mean,
+        "Elevation_Std": np.sqrt(variance),
+        "Area_m2": sums["area"],
+        "Area_Weighted_Elevation": sums["area_total"] / sums["area"],
+    })
+
+
+def pixel_rollup(data, id_column, levels=GEOID_LEVELS):
+    """
+    Exact pixel-level statistics for every level of a GEOID hierarchy, from
+    the additive partial sums in a zonal_stats.py output (see
+    ``PIXEL_SUM_COLUMNS``). Unlike averaging polygon means, every pixel counts
+    once, and the area-weighted mean accounts for pixels shrinking towards the
+    poles. A group with any polygon lacking partial sums (rows carried over
+    from older outputs) is reported as missing.
+    """
+    frame = data.rename(columns=PIXEL_SUM_COLUMNS)
+    sums = sum_rollup(frame, id_column, PIXEL_SUM_COLUMNS.values(), levels, propagate_missing=True)
+    return {level: summarize_pixel_sums(level_sums) for level, level_sums in sums.items()}
+
+
+def region_pixel_rollup(data, id_column, regions, region_column):
+    """
+    Exact pixel-level statistics for custom regions. ``regions`` maps each
+    polygon in ``id_column`` to a region in ``region_column``; polygons
+    without a region are left out.
+    """
+    frame = data.rename(columns=PIXEL_SUM_COLUMNS)
+    frame = frame.merge(regions[[id_column, region_column]], on=id_column, how="inner")
+    columns = list(PIXEL_SUM_COLUMNS.values())
+    sums = _group_sums(frame[columns].astype(float), frame[region_column].astype(str).to_numpy(), True)
+    return summarize_pixel_sums(sums.reset_index())
@@ -0,0 +1,292 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+from mosaic import DatasetPool
+from result_cache import tile_identity
+
+try:
+    import fcntl
+except ImportError:  # Windows: tile creation and eviction are not locked across processes
+    fcntl = None
+
+# Rows per cache block of tiles stored in strips, whose internal blocks are single rows
+STRIP_BLOCK_ROWS = 512
+
+
+# Function to pick the directory of the shared cache: shared memory where there is one
+def default_directory():
+    root = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(root, "elevation_blocks")
+
+
+class SharedBlockCache(DatasetPool):
+    """
+    ``DatasetPool`` whose windowed reads go through an uncompressed copy of
+    each tile shared by every process on the machine.
+
+    Each tile gets a sparse ``.npy`` file (``np.lib.format.open_memmap``) the
+    size of the tile in ``directory`` (by default under ``/dev/shm``), with a
+    bitmap of which of its blocks have been decoded. A read decodes only the
+    blocks of the window that no process has decoded yet, and returns a
+    read-only view of the memory map: no copy, and no decompression for
+    blocks that neighbouring polygons or other workers already read. Blocks
+    follow the tile's internal tiling (bands of ``STRIP_BLOCK_ROWS`` rows for
+    striped files). Files are named after the tile's version, so an updated
+    tile is never served from stale blocks.
+
+    The decoded bytes of all tiles are counted in a file shared by the
+    processes. Before decoding, a process reserves room for the blocks it is
+    about to decode; when they would not fit in ``max_bytes``, whole tiles
+    are evicted, least recently read first. A process that still maps an
+    evicted tile notices on its next read of it and maps a new copy.
+    ``max_bytes`` is capped at the free space of ``directory``, since writing
+    into a memory-mapped file on a full tmpfs kills the process.
+
+    The files outlive the processes that read them; ``clear`` removes them
+    (``run_zonal_stats`` does so at the end of every run).
+    """
+
+    def __init__(self, directory=None, max_bytes=4 * 2 ** 30, max_open=32):
+        super().__init__(max_open)
+        self.directory = directory or default_directory()
+        os.makedirs(self.directory, exist_ok=True)
+        self.max_bytes = min(max_bytes, int(shutil.disk_usage(self.directory).free * 0.9))
+        self._maps = OrderedDict()
+        self._lock_path = os.path.join(self.directory, ".lock")
+        self._usage_path = os.path.join(self.directory, ".usage")
+
+    def _locked(self):
+        return _FileLock(self._lock_path)
+
+    # Function to name the files of a tile after its version
+    @staticmethod
+    def _key(tile):
+        digest = hashlib.sha1(tile_identity(tile).encode()).hexdigest()[:16]
+        return f"{os.path.splitext(tile.name)[0]}-{digest}"
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".npy", base + ".blocks.npy", base + ".json"
+
+    def _create(self, tile, key):
+        data_path, bitmap_path, meta_path = self._paths(key)
+        block_rows, block_cols = self.get(tile.path).block_shapes[0]
+        if block_rows < 128:
+            block_rows, block_cols = STRIP_BLOCK_ROWS, tile.width
+        block_shape = (-(-tile.height // block_rows), -(-tile.width // block_cols))
+        # Sparse files: memory is only taken up by the blocks that are written
+        np.lib.format.open_memmap(data_path, mode="w+", dtype=tile.dtype, shape=(tile.height, tile.width))
+        np.lib.format.open_memmap(bitmap_path, mode="w+", dtype=np.uint8, shape=block_shape)
+        # The metadata file is written last; its presence means the tile is ready
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump({"block_rows": block_rows, "block_cols": block_cols, "height": tile.height,
+                       "width": tile.width, "dtype": tile.dtype}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+
+    # Function to map the cached copy of a tile, creating it on first use
+    def _open(self, tile):
+        key = self._key(tile)
+        entry = self._maps.pop(key, None)
+        if entry is None:
+            data_path, bitmap_path, meta_path = self._paths(key)
+            # Under the lock, so no other process evicts the files between the check and the mapping
+            with self._locked():
+                if not os.path.exists(meta_path):
+                    self._create(tile, key)
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                entry = (np.load(data_path, mmap_mode="r+"), np.load(bitmap_path, mmap_mode="r+"),
+                         meta["block_rows"], meta["block_cols"], bitmap_path)
+        self._maps[key] = entry
+        while len(self._maps) > self.max_open:
+            self._maps.popitem(last=False)
+        return entry
+
+    def read(self, tile, window):
+        key = self._key(tile)
+        row_start, col_start = int(window.row_off), int(window.col_off)
+        row_stop, col_stop = row_start + int(window.height), col_start + int(window.width)
+        while True:
+            entry = self._open(tile)
+            data, decoded, block_rows, block_cols, bitmap_path = entry
+            block_row_start, block_row_stop = row_start // block_rows, -(-row_stop // block_rows)
+            block_col_start, block_col_stop = col_start // block_cols, -(-col_stop // block_cols)
+            missing = np.argwhere(decoded[block_row_start:block_row_stop, block_col_start:block_col_stop] == 0)
+            blocks = []
+            for block_row, block_col in (missing + (block_row_start, block_col_start)).tolist():
+                rows = slice(block_row * block_rows, min((block_row + 1) * block_rows, tile.height))
+                cols = slice(block_col * block_cols, min((block_col + 1) * block_cols, tile.width))
+                blocks.append((block_row, block_col, rows, cols))
+            nbytes = sum(_page_bytes(data, rows, cols) for _, _, rows, cols in blocks)
+            # When another process has evicted the tile, its files are gone: drop the stale map and
+            # create the tile again, so no blocks are decoded into files the budget no longer counts
+            if self._reserve(key, bitmap_path, nbytes):
+                break
+            self._maps.pop(key, None)
+
+        if blocks:
+            try:
+                src = self.get(tile.path)
+                for block_row, block_col, rows, cols in blocks:
+                    block_window = ((rows.start, rows.stop), (cols.start, cols.stop))
+                    data[rows, cols] = src.read(1, window=block_window)
+                    # Flag the block only once its pixels are in place
+                    decoded[block_row, block_col] = 1
+            finally:
+                self._release(nbytes)
+
+        view = np.asarray(data[row_start:row_stop, col_start:col_stop])
+        view.flags.writeable = False
+        return view
+
+    # Function to mark a tile as just used and reserve room for ``nbytes`` of its blocks, evicting
+    # other tiles when they would not fit. Returns False when the tile itself has been evicted.
+    def _reserve(self, key, bitmap_path, nbytes):
+        with self._locked():
+            # The bitmap's modification time is the tile's last use, for eviction
+            try:
+                os.utime(bitmap_path)
+            except FileNotFoundError:
+                return False
+            if not nbytes:
+                return True
+            usage = _read_usage(self._usage_path)
+            decoded, pending = usage or (None, 0)
+            if decoded is None or decoded + pending + nbytes > self.max_bytes:
+                decoded = self._evict(pending + nbytes, key)
+            _write_usage(self._usage_path, decoded, pending + nbytes)
+        return True
+
+    # Function to count reserved bytes as decoded once their blocks are written
+    def _release(self, nbytes):
+        with self._locked():
+            usage = _read_usage(self._usage_path)
+            if usage is not None:
+                decoded, pending = usage
+                _write_usage(self._usage_path, decoded + nbytes, max(pending - nbytes, 0))
+
+    # Function to evict the least recently read tiles other than ``keep`` until the decoded
+    # blocks and ``reserve`` more bytes fit in ``max_bytes``, returning the bytes left decoded
+    def _evict(self, reserve=0, keep=None):
+        tiles = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json"):
+                    continue
+                key = entry.name[:-len(".json")]
+                data_path, bitmap_path, meta_path = self._paths(key)
+                try:
+                    with open(meta_path) as f:
+                        meta = json.load(f)
+                    decoded = np.load(bitmap_path, mmap_mode="r")
+                    used = os.stat(bitmap_path).st_mtime
+                    nbytes = _cached_bytes(data_path, decoded, meta)
+                except (OSError, ValueError):
+                    continue
+                tiles.append((used, key, nbytes))
+
+        total = sum(nbytes for _, _, nbytes in tiles)
+        for _, key, nbytes in sorted(tiles):
+            if total + reserve <= self.max_bytes:
+                break
+            if key != keep:
+                self._remove(key)
+                total -= nbytes
+        return total
+
+    def _remove(self, key):
+        self._maps.pop(key, None)
+        # Remove the metadata first, so no process starts using a half-removed tile
+        for path in self._paths(key)[::-1]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def evict(self):
+        """Evict the least recently read tiles until the decoded blocks fit in ``max_bytes``."""
+        with self._locked():
+            _, pending = _read_usage(self._usage_path) or (None, 0)
+            _write_usage(self._usage_path, self._evict(pending), pending)
+
+    def clear(self):
+        """Remove every cached tile, freeing the memory they take up in ``/dev/shm``."""
+        with self._locked():
+            with os.scandir(self.directory) as entries:
+                keys = {entry.name[:-len(".json")] for entry in entries if entry.name.endswith(".json")}
+            for key in keys:
+                self._remove(key)
+            # Files of tiles whose creation was interrupted before their metadata was written
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name != ".lock":
+                        os.remove(entry.path)
+
+    def close(self):
+        self._maps.clear()
+        super().close()
+
+
+# Function to read the decoded and reserved bytes recorded in the usage file (None when it is missing)
+def _read_usage(path):
+    try:
+        with open(path) as f:
+            decoded, pending = map(int, f.read().split())
+    except (OSError, ValueError):
+        return None
+    return decoded, pending
+
+
+def _write_usage(path, decoded, pending):
+    with open(path, "w") as f:
+        f.write(f"{decoded} {pending}")
+
+
+# Function to count the bytes of the memory pages a block of a memory-mapped tile spans. The
+# copy is stored row by row, so a narrow block touches a page in each of its rows.
+def _page_bytes(data, rows, cols):
+    row_bytes = data.shape[1] * data.itemsize
+    starts = data.offset + np.arange(rows.start, rows.stop) * row_bytes + cols.start * data.itemsize
+    ends = starts + (cols.stop - cols.start) * data.itemsize
+    return int(((ends - 1) // mmap.PAGESIZE - starts // mmap.PAGESIZE + 1).sum()) * mmap.PAGESIZE
+
+
+# Function to measure the memory the copy of a tile takes up: the space allocated to its
+# sparse file where the platform reports it, otherwise the bytes of its decoded blocks
+def _cached_bytes(data_path, decoded, meta):
+    blocks = getattr(os.stat(data_path), "st_blocks", None)
+    return blocks * 512 if blocks is not None else _decoded_bytes(decoded, meta)
+
+
+# Function to add up the bytes of the decoded blocks of a tile, edge blocks included
+def _decoded_bytes(decoded, meta):
+    block_rows, block_cols = meta["block_rows"], meta["block_cols"]
+    rows = np.minimum(block_rows, meta["height"] - block_rows * np.arange(decoded.shape[0]))
+    cols = np.minimum(block_cols, meta["width"] - block_cols * np.arange(decoded.shape[1]))
+    return int(rows @ (decoded != 0).astype(np.int64) @ cols) * np.dtype(meta["dtype"]).itemsize
+
+
+class _FileLock:
+    """Exclusive lock on a file, held by at most one process at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._file = open(self.path, "a")
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+        self._file.close()
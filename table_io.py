@@ -0,0 +1,87 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PARQUET_SUFFIXES = (".parquet", ".pq")
+
+# Rows per Parquet row group when writing in batches
+ROW_GROUP_SIZE = 100_000
+
+
+def is_parquet(path):
+    return str(path).lower().endswith(PARQUET_SUFFIXES)
+
+
+# Function to pick the first of several candidate files that exists
+def first_existing(*paths):
+    for path in paths:
+        if os.path.exists(path):
+            return path
+    return paths[-1]
+
+
+# Function to list the column names of a table without loading it
+def table_columns(path):
+    if is_parquet(path):
+        return pq.read_schema(path).names
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_table(path, columns=None, id_columns=()):
+    """
+    Read a CSV or Parquet table, chosen by file extension. Only ``columns``
+    are loaded (all when None). ``id_columns`` are read as strings from CSV
+    so GEOIDs and ZIP codes keep their leading zeros; Parquet files store
+    them typed already.
+    """
+    if is_parquet(path):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, dtype={column: str for column in id_columns})
+
+
+def write_table(df, path):
+    """Write ``df`` to CSV or Parquet, chosen by file extension, via a temporary file."""
+    tmp_path = path + ".tmp"
+    if is_parquet(path):
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+class ParquetBatchWriter:
+    """
+    Write rows to a Parquet file one row group at a time, so a large result
+    set never has to be held in memory. ``schema`` is a list of
+    ``(column, pyarrow type)``. The file is written under a temporary name
+    and moved into place on ``close``.
+    """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = pa.schema(schema)
+        self._tmp_path = path + ".tmp"
+        self._writer = pq.ParquetWriter(self._tmp_path, self.schema)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self._writer.close()
+            os.remove(self._tmp_path)
+
+    def write_rows(self, rows):
+        """Write a batch of row tuples as one row group."""
+        if rows:
+            columns = list(zip(*rows))
+            arrays = [pa.array(column, type=field.type) for column, field in zip(columns, self.schema)]
+            self._writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
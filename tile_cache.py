@@ -0,0 +1,138 @@
+import json
+import os
+import re
+import time
+
+from shapely import STRtree, box
+
+from tile_downloader import download_files
+
+# USGS tile names give the latitude/longitude of the tile's top-left corner,
+# e.g. USGS_13_n06e162.tif covers 5-6°N, 162-163°E
+TILE_NAME = re.compile(r"([ns])(\d{2})([ew])(\d{3})", re.IGNORECASE)
+
+# CRS of the USGS tiles (NAD83 longitude/latitude), which tile footprints from names are in
+TILE_CRS = "EPSG:4269"
+
+
+# Function to work out a tile's nominal 1°x1° bounds from its name alone
+def tile_bounds_from_name(name):
+    match = TILE_NAME.search(os.path.basename(name))
+    if match is None:
+        raise ValueError(f"Cannot read tile bounds from {name!r}")
+    ns, lat, ew, lon = match.groups()
+    top = int(lat) if ns.lower() == "n" else -int(lat)
+    left = int(lon) if ew.lower() == "e" else -int(lon)
+    return (left, top - 1, left + 1, top)
+
+
+class LinkIndex:
+    """Spatial index of the tile URLs in ``tif_links.txt``, built without downloading anything."""
+
+    def __init__(self, urls):
+        self.urls = []
+        footprints = []
+        for url in urls:
+            try:
+                footprints.append(box(*tile_bounds_from_name(url)))
+            except ValueError as e:
+                print(f"Warning: Skipping {url} - {e}")
+                continue
+            self.urls.append(url)
+        self._tree = STRtree(footprints)
+
+    def query(self, bbox):
+        return [self.urls[i] for i in sorted(self._tree.query(box(*bbox)))]
+
+
+class TileCache:
+    """
+    Size-capped local cache of elevation tiles, fetched on demand.
+
+    Tiles are downloaded only when a polygon being processed needs them and
+    are evicted least-recently-used once the cache grows beyond
+    ``max_bytes``. The tiles of the batch currently being processed are never
+    evicted, so a single batch may exceed the cap temporarily.
+
+    Polygons are matched to tiles by longitude/latitude, so they must be in
+    ``crs`` (the CRS of the tiles) before they are planned.
+    """
+
+    MANIFEST = ".tile_cache.json"
+
+    def __init__(self, cache_dir, link_index, max_bytes, workers=8, max_batch_tiles=64, crs=TILE_CRS):
+        self.cache_dir = cache_dir
+        self.crs = crs
+        self.link_index = link_index
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.max_batch_tiles = max_batch_tiles
+        os.makedirs(cache_dir, exist_ok=True)
+        self._manifest_path = os.path.join(cache_dir, self.MANIFEST)
+        self._last_used = {}
+        if os.path.exists(self._manifest_path):
+            with open(self._manifest_path, "r") as f:
+                self._last_used = json.load(f)
+
+    def plan(self, features):
+        """
+        Split ``(feature_id, geometry)`` pairs into batches that need at most
+        ``max_batch_tiles`` tiles each. Yields ``(features, urls)`` per batch.
+        Features that no tile covers are passed through with the first batch.
+        """
+        keyed = []
+        for feature_id, geometry in features:
+            urls = () if geometry is None or geometry.is_empty else tuple(self.link_index.query(geometry.bounds))
+            keyed.append((urls, feature_id, geometry))
+        keyed.sort(key=lambda item: item[0])
+
+        batch, batch_urls = [], set()
+        for urls, feature_id, geometry in keyed:
+            if batch and len(batch_urls | set(urls)) > self.max_batch_tiles:
+                yield batch, batch_urls
+                batch, batch_urls = [], set()
+            batch.append((feature_id, geometry))
+            batch_urls.update(urls)
+        if batch:
+            yield batch, batch_urls
+
+    def ensure(self, urls):
+        """
+        Download any of ``urls`` missing from the cache, then evict down to the
+        size cap. Returns the set of URLs that could not be downloaded.
+        """
+        _, failed = download_files(sorted(urls), self.cache_dir, workers=self.workers, verify_existing=False)
+        for url in failed:
+            print(f"Warning: {os.path.basename(url)} is unavailable; polygons on it are skipped until a later run")
+
+        now = time.time()
+        pinned = {os.path.basename(url) for url in urls}
+        for name in pinned:
+            self._last_used[name] = now
+        self.evict(pinned)
+        return set(failed)
+
+    def evict(self, pinned=()):
+        sizes = {}
+        with os.scandir(self.cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith((".tif", ".tiff")):
+                    stat = entry.stat()
+                    sizes[entry.name] = stat.st_size
+                    self._last_used.setdefault(entry.name, stat.st_mtime)
+
+        total = sum(sizes.values())
+        for name in sorted(sizes, key=lambda name: self._last_used[name]):
+            if total <= self.max_bytes:
+                break
+            if name in pinned:
+                continue
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= sizes[name]
+            del self._last_used[name]
+
+        self._last_used = {name: used for name, used in self._last_used.items() if name in sizes}
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._last_used, f)
+        os.replace(tmp_path, self._manifest_path)
@@ -0,0 +1,187 @@
+import json
+import os
+
+import numpy as np
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+
+import rasterio
+from affine import Affine
+from rasterio.crs import CRS
+from shapely import STRtree, box, points
+
+# Bump whenever the on-disk layout of the catalog changes
+CATALOG_VERSION = 1
+
+TIF_EXTENSIONS = (".tif", ".tiff")
+
+
+@lru_cache(maxsize=None)
+def crs_is_geographic(crs):
+    return bool(crs) and CRS.from_user_input(crs).is_geographic
+
+
+@dataclass(frozen=True)
+class TileInfo:
+    """Header metadata of one elevation tile, as recorded in the catalog."""
+    path: str
+    bounds: tuple
+    crs: str
+    transform: tuple
+    width: int
+    height: int
+    nodata: float
+    dtype: str
+    mtime: float
+    size: int
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    @property
+    def affine(self):
+        return Affine(*self.transform)
+
+    @property
+    def geographic(self):
+        return crs_is_geographic(self.crs)
+
+
+# Function to read the header of a single TIF file
+def read_tile_info(tif_path, stat=None):
+    stat = stat or os.stat(tif_path)
+    with rasterio.open(tif_path) as src:
+        return TileInfo(
+            path=tif_path,
+            bounds=tuple(src.bounds),
+            crs=src.crs.to_string() if src.crs else "",
+            transform=tuple(src.transform)[:6],
+            width=src.width,
+            height=src.height,
+            nodata=src.nodata,
+            dtype=src.dtypes[0],
+            mtime=stat.st_mtime,
+            size=stat.st_size,
+        )
+
+
+class TileCatalog:
+    """
+    Spatial index over the tiles in an elevation directory.
+
+    Tile headers are read once and persisted next to the directory; on later
+    loads only files whose mtime or size changed are reopened. Lookups go
+    through an in-memory STRtree of the tile footprints.
+    """
+
+    def __init__(self, elevation_dir, tiles):
+        self.elevation_dir = elevation_dir
+        self.tiles = sorted(tiles, key=lambda tile: tile.name)
+        self._by_path = {tile.path: tile for tile in self.tiles}
+        self._order = {tile.path: i for i, tile in enumerate(self.tiles)}
+        self._tree = STRtree([box(*tile.bounds) for tile in self.tiles])
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __iter__(self):
+        return iter(self.tiles)
+
+    def get(self, tif_path):
+        return self._by_path[tif_path]
+
+    def query(self, bbox):
+        """Return the paths of all tiles whose bounds intersect ``bbox``."""
+        return [tile.path for tile in self.query_tiles(bbox)]
+
+    def query_tiles(self, bbox):
+        if not self.tiles:
+            return []
+        hits = sorted(self._tree.query(box(*bbox)))
+        return [self.tiles[i] for i in hits]
+
+    def locate(self, xs, ys):
+        """
+        Index into ``tiles`` of the tile holding each point of ``xs``/``ys``,
+        or -1 for points outside every tile. A point covered by overlapping
+        tiles gets the first of them in catalog order.
+        """
+        outside = len(self.tiles)
+        located = np.full(len(xs), outside, dtype=np.int64)
+        if self.tiles and len(xs):
+            point_index, tile_index = self._tree.query(points(xs, ys))
+            np.minimum.at(located, point_index, tile_index)
+        located[located == outside] = -1
+        return located
+
+    def claimed_bounds(self, tif_path):
+        """
+        Bounds of the tiles that overlap ``tif_path`` and come before it in
+        catalog order. Pixels shared by overlapping tiles are counted by the
+        first tile, so these are the parts of ``tif_path`` to skip.
+        """
+        order = self._order[tif_path]
+        return [other.bounds for other in self.query_tiles(self.get(tif_path).bounds)
+                if self._order[other.path] < order]
+
+    @staticmethod
+    def default_cache_path(elevation_dir):
+        return os.path.normpath(elevation_dir) + "_catalog.json"
+
+    @classmethod
+    def load(cls, elevation_dir, cache_path=None):
+        """
+        Build the catalog for ``elevation_dir``, reusing the cached headers of
+        tiles that have not changed on disk since the last run.
+        """
+        cache_path = cache_path or cls.default_cache_path(elevation_dir)
+        cached = {}
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, "r") as f:
+                    payload = json.load(f)
+                if payload.get("version") == CATALOG_VERSION:
+                    for entry in payload["tiles"]:
+                        entry["bounds"] = tuple(entry["bounds"])
+                        entry["transform"] = tuple(entry["transform"])
+                        cached[entry["path"]] = TileInfo(**entry)
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                print(f"Warning: Ignoring unreadable tile catalog {cache_path} - {e}")
+                cached = {}
+
+        tiles = []
+        changed = False
+        if os.path.isdir(elevation_dir):
+            with os.scandir(elevation_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or not entry.name.lower().endswith(TIF_EXTENSIONS):
+                        continue
+                    stat = entry.stat()
+                    tile = cached.pop(entry.path, None)
+                    if tile is None or tile.mtime != stat.st_mtime or tile.size != stat.st_size:
+                        try:
+                            tile = read_tile_info(entry.path, stat)
+                        except rasterio.errors.RasterioError as e:
+                            print(f"Warning: Skipping {entry.path} due to error - {e}")
+                            continue
+                        changed = True
+                    tiles.append(tile)
+
+        # Tiles left in the cache were removed from disk
+        changed = changed or bool(cached)
+
+        catalog = cls(elevation_dir, tiles)
+        if changed or not os.path.exists(cache_path):
+            catalog.save(cache_path)
+        return catalog
+
+    def save(self, cache_path):
+        payload = {
+            "version": CATALOG_VERSION,
+            "tiles": [asdict(tile) for tile in self.tiles],
+        }
+        tmp_path = cache_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(payload, f)
+        os.replace(tmp_path, cache_path)
@@ -0,0 +1,251 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+CHUNK_SIZE = 1 << 20  # 1 MiB
+TIMEOUT = 60
+
+# S3 ETags of single-part uploads are the MD5 of the object
+MD5_ETAG = re.compile(r"^[0-9a-f]{32}$")
+
+# Size and ETag of every verified download, kept in the download directory
+VERSIONS_FILE = ".download_versions.json"
+
+
+class IntegrityError(Exception):
+    """Raised when a downloaded file does not match the size or ETag announced by the server."""
+
+
+class RateLimiter:
+    """Token bucket shared by all download threads to cap total bandwidth."""
+
+    def __init__(self, bytes_per_sec):
+        self.rate = bytes_per_sec
+        self._allowance = bytes_per_sec
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes):
+        with self._lock:
+            now = time.monotonic()
+            self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+            self._last = now
+            self._allowance -= nbytes
+            wait = -self._allowance / self.rate if self._allowance < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+class SessionPool:
+    """
+    One keep-alive ``requests.Session`` per download thread. ``max_retries``
+    is passed to each session's ``HTTPAdapter`` (an int or a urllib3 ``Retry``).
+    """
+
+    def __init__(self, pool_size=8, max_retries=0):
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self._local = threading.local()
+
+    def get(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size,
+                                  max_retries=self.max_retries)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            self._local.session = session
+        return session
+
+
+# Function to ask the server for the size and ETag of a file
+def remote_info(session, url):
+    response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    response.raise_for_status()
+    size = response.headers.get("Content-Length")
+    etag = response.headers.get("ETag", "").strip('"') or None
+    return (int(size) if size is not None else None), etag
+
+
+# Function to compare a finished file against the size and ETag from the server
+def verify_file(path, size, etag):
+    actual_size = os.path.getsize(path)
+    if size is not None and actual_size != size:
+        raise IntegrityError(f"{path} is {actual_size} bytes, expected {size}")
+    if etag and MD5_ETAG.match(etag):
+        md5 = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                md5.update(chunk)
+        if md5.hexdigest() != etag:
+            raise IntegrityError(f"{path} does not match ETag {etag}")
+
+
+# Function to tell whether a local file differs from the server's copy, by size and by
+# the ETag it was downloaded with or, failing that, its MD5 checksum
+def is_outdated(path, size, etag, known=None):
+    if size is not None and os.path.getsize(path) != size:
+        return True
+    if etag and known and known.get("etag"):
+        return known["etag"] != etag
+    try:
+        verify_file(path, size, etag)
+    except IntegrityError:
+        return True
+    return False
+
+
+# Function to read the recorded size and ETag of the files in a download directory
+def load_versions(save_dir):
+    path = os.path.join(save_dir, VERSIONS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_versions(save_dir, versions):
+    path = os.path.join(save_dir, VERSIONS_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(versions, f)
+    os.replace(path + ".tmp", path)
+
+
+def download_file(session, url, save_path, limiter=None, retries=5, backoff=1.0):
+    """
+    Download ``url`` to ``save_path`` through a ``.part`` file.
+
+    An existing ``.part`` file is resumed with an HTTP Range request. The
+    result is checked against the size and ETag from a HEAD request before it
+    is renamed into place, so ``save_path`` only ever holds complete files.
+    Failed attempts are retried with exponential backoff. Returns
+    ``(size, etag)`` of the downloaded file.
+    """
+    part_path = save_path + ".part"
+    for attempt in range(retries + 1):
+        try:
+            size, etag = remote_info(session, url)
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            if size is not None and offset > size:
+                offset = 0
+
+            if size is None or offset < size:
+                headers = {}
+                if offset:
+                    headers["Range"] = f"bytes={offset}-"
+                    if etag:
+                        headers["If-Range"] = f'"{etag}"'
+                with session.get(url, headers=headers, stream=True, timeout=TIMEOUT) as response:
+                    response.raise_for_status()
+                    if response.status_code != 206:
+                        offset = 0  # Server sent the whole file (range ignored or file changed)
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                            if limiter is not None:
+                                limiter.consume(len(chunk))
+                            f.write(chunk)
+
+            try:
+                verify_file(part_path, size, etag)
+            except IntegrityError:
+                os.remove(part_path)  # Start from scratch on the next attempt
+                raise
+            os.replace(part_path, save_path)
+            return size, etag
+        except (requests.RequestException, OSError, IntegrityError) as e:
+            if attempt == retries:
+                raise
+            delay = backoff * 2 ** attempt
+            print(f"Retrying {os.path.basename(save_path)} in {delay:.0f}s after error - {e}")
+            time.sleep(delay)
+
+
+# Function to read the URLs listed in a links file
+def read_links(url_file):
+    with open(url_file, "r") as file:
+        return [line.strip() for line in file if line.strip()]
+
+
+def iter_downloads(urls, save_dir, workers=8, max_bytes_per_sec=None, retries=5, verify_existing=True,
+                   refresh=False):
+    """
+    Download every URL in ``urls`` into ``save_dir`` on ``workers`` threads,
+    yielding ``(url, (size, etag) or None, error or None)`` as each one
+    finishes, so callers can process finished files while the rest are still
+    downloading.
+
+    Files that already exist are skipped; with ``verify_existing`` their size
+    is first checked against the server, and truncated files left behind by
+    older versions of this script are downloaded again. With ``refresh``,
+    existing files that changed on the server (different size, a different
+    ETag from the one they were downloaded with or, for files downloaded
+    before ETags were recorded, a different MD5 checksum) are downloaded
+    again and replaced atomically. The size and ETag of verified files are
+    recorded in ``VERSIONS_FILE`` in ``save_dir``.
+    """
+    os.makedirs(save_dir, exist_ok=True)
+    sessions = SessionPool(workers)
+    limiter = RateLimiter(max_bytes_per_sec) if max_bytes_per_sec else None
+    versions = load_versions(save_dir)
+
+    # Returns the (size, etag) of the file and whether its content was verified against them
+    def fetch(url):
+        name = os.path.basename(url)
+        save_path = os.path.join(save_dir, name)
+        session = sessions.get()
+        if os.path.exists(save_path):
+            if not (verify_existing or refresh):
+                return None, False
+            size, etag = remote_info(session, url)
+            if refresh:
+                if not is_outdated(save_path, size, etag, versions.get(name)):
+                    return (size, etag), True
+                print(f"Updating {name}, which changed on the server")
+                return download_file(session, url, save_path, limiter, retries), True
+            if size is None or os.path.getsize(save_path) == size:
+                return (size, etag), False
+            print(f"Re-downloading truncated {name}")
+            os.remove(save_path)
+        return download_file(session, url, save_path, limiter, retries), True
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(fetch, url): url for url in urls}
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    info, verified = future.result()
+                except Exception as e:
+                    yield url, None, e
+                    continue
+                if verified:
+                    versions[os.path.basename(url)] = {"size": info[0], "etag": info[1]}
+                yield url, info, None
+    finally:
+        save_versions(save_dir, versions)
+
+
+def download_files(urls, save_dir, workers=8, max_bytes_per_sec=None, retries=5, verify_existing=True,
+                   refresh=False):
+    """
+    Download every URL in ``urls`` into ``save_dir`` (see ``iter_downloads``).
+    Returns ``({filename: (size, etag)}, [failed urls])``.
+    """
+    downloaded, failed = {}, []
+    downloads = iter_downloads(urls, save_dir, workers, max_bytes_per_sec, retries, verify_existing, refresh)
+    for url, info, error in tqdm(downloads, total=len(urls), desc="Downloading Tiles"):
+        if error is not None:
+            print(f"Failed to download {os.path.basename(url)}: {error}")
+            failed.append(url)
+        elif info is not None:
+            downloaded[os.path.basename(url)] = info
+    return downloaded, failed
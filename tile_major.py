@@ -0,0 +1,164 @@
+import math
+import time
+
+import numpy as np
+from rasterio.features import rasterize
+from rasterio.windows import Window, bounds as window_bounds
+import shapely
+from shapely import STRtree, box
+
+from elevation_stats import ElevationStats, slope_degrees
+from mosaic import pixel_height, pixel_row_areas, valid_data_mask
+
+# Row height of the bands read from tiles that are stored in strips
+STRIP_BAND_ROWS = 512
+
+
+# Function to list the windows a tile is read in, one internal block at a time
+def iter_read_windows(src):
+    block_rows, _ = src.block_shapes[0]
+    if block_rows >= 128:
+        for _, window in src.block_windows(1):
+            yield window
+    else:
+        # Striped files have one-row blocks; read them in bands instead
+        for row in range(0, src.height, STRIP_BAND_ROWS):
+            yield Window(0, row, src.width, min(STRIP_BAND_ROWS, src.height - row))
+
+
+# Function to convert the bounds of another tile to a pixel slice of this one
+def claimed_slices(claimed_bounds, transform, shape):
+    slices = []
+    for left, bottom, right, top in claimed_bounds:
+        col_start = max(round((left - transform.c) / transform.a), 0)
+        col_stop = min(round((right - transform.c) / transform.a), shape[1])
+        row_start = max(round((transform.f - top) / -transform.e), 0)
+        row_stop = min(round((transform.f - bottom) / -transform.e), shape[0])
+        if col_start < col_stop and row_start < row_stop:
+            slices.append((row_start, row_stop, col_start, col_stop))
+    return slices
+
+
+# Function to fold the pixels of one block into the histogram, area and slope sums of each label
+def _add_label_pixels(pixel_stats, statistics, block_labels, values, areas, slopes):
+    order = np.argsort(block_labels, kind="stable")
+    labels, starts = np.unique(block_labels[order], return_index=True)
+    for label, indices in zip(labels.tolist(), np.split(order, starts[1:])):
+        stats = pixel_stats.get(label)
+        if stats is None:
+            stats = pixel_stats[label] = ElevationStats(statistics=statistics)
+        stats.add_pixel_statistics(values[indices], areas[indices], None if slopes is None else slopes[indices])
+
+
+def compute_tile_stats(src, polygons, claimed_bounds=(), timings=None, statistics=None, read=None):
+    """
+    Summarise every polygon of ``polygons`` (a list of ``(key, geometry)``)
+    over the open tile ``src`` in a single pass.
+
+    The tile is read block by block. For each block, the polygons that overlap
+    it are burned into an integer label array and the per-label partial sums
+    of ``ElevationStats`` are taken with ``np.bincount``. A block entirely
+    inside one (prepared) polygon is labelled without rasterizing, and the
+    polygons of other blocks are clipped to the block before rasterizing.
+    Pixels inside ``claimed_bounds`` (the bounds of tiles that already count
+    the overlap they share with this one) are skipped, so seams are never
+    counted twice.
+    Polygons must not overlap each other. Returns ``{key: ElevationStats}``
+    for the polygons that received at least one valid pixel. With a
+    ``timings`` dict, the seconds spent reading, labelling (mask) and
+    reducing blocks and the bytes read are added to it. With a
+    ``StatisticSet`` that needs the pixels, its histogram, area and slope
+    sums are taken per label too (slopes within each block). Blocks are
+    read with ``read(window)`` when given (e.g. through a
+    ``SharedBlockCache``), and from ``src`` otherwise.
+    """
+    keys = [key for key, _ in polygons]
+    geometries = [geometry for _, geometry in polygons]
+    tree = STRtree(geometries)
+    shapely.prepare(geometries)
+    size = len(polygons) + 1  # label 0 is outside every polygon
+
+    count = np.zeros(size, dtype=np.int64)
+    total = np.zeros(size, dtype=np.float64)
+    total_sq = np.zeros(size, dtype=np.float64)
+    minimum = np.full(size, math.inf)
+    maximum = np.full(size, -math.inf)
+    area = np.zeros(size, dtype=np.float64)
+    area_total = np.zeros(size, dtype=np.float64)
+    if statistics is not None and not statistics.needs_pixels:
+        statistics = None
+    pixel_stats = {}
+    skip = claimed_slices(claimed_bounds, src.transform, (src.height, src.width))
+    geographic = src.crs is not None and src.crs.is_geographic
+    seconds = dict.fromkeys(("read", "mask", "reduce"), 0.0)
+    bytes_read = 0
+
+    for window in iter_read_windows(src):
+        start = time.perf_counter()
+        bounds = window_bounds(window, src.transform)
+        hits = tree.query(box(*bounds))
+        if len(hits) == 0:
+            continue
+
+        shape = (window.height, window.width)
+        if len(hits) == 1 and geometries[hits[0]].contains(box(*bounds)):
+            labels = np.full(shape, int(hits[0]) + 1, dtype=np.int32)
+        else:
+            clipped = shapely.clip_by_rect([geometries[i] for i in hits], *bounds)
+            labels = rasterize(
+                ((geometry, int(i) + 1) for geometry, i in zip(clipped, hits) if not geometry.is_empty),
+                out_shape=shape,
+                transform=src.window_transform(window),
+                fill=0,
+                dtype="int32",
+            )
+        for row_start, row_stop, col_start, col_stop in skip:
+            rows = slice(max(row_start - window.row_off, 0), max(row_stop - window.row_off, 0))
+            cols = slice(max(col_start - window.col_off, 0), max(col_stop - window.col_off, 0))
+            labels[rows, cols] = 0
+        if not labels.any():
+            seconds["mask"] += time.perf_counter() - start
+            continue
+        labelled = time.perf_counter()
+
+        data = read(window) if read is not None else src.read(1, window=window)
+        bytes_read += data.nbytes
+        read_done = time.perf_counter()
+        has_data = valid_data_mask(data, src.nodata)
+        valid = (labels > 0) & has_data
+        block_labels = labels[valid]
+        values = data[valid].astype(np.float64)
+        row_areas = pixel_row_areas(src.transform, window.height, geographic, window.row_off)
+        areas = np.broadcast_to(row_areas[:, None], shape)[valid]
+
+        count += np.bincount(block_labels, minlength=size)
+        total += np.bincount(block_labels, weights=values, minlength=size)
+        total_sq += np.bincount(block_labels, weights=values * values, minlength=size)
+        np.minimum.at(minimum, block_labels, values)
+        np.maximum.at(maximum, block_labels, values)
+        area += np.bincount(block_labels, weights=areas, minlength=size)
+        area_total += np.bincount(block_labels, weights=values * areas, minlength=size)
+        if statistics is not None and block_labels.size:
+            slopes = None
+            if statistics.slope:
+                slopes = slope_degrees(data, has_data, row_areas, pixel_height(src.transform, geographic))[valid]
+            _add_label_pixels(pixel_stats, statistics, block_labels, values, areas, slopes)
+        seconds["mask"] += labelled - start
+        seconds["read"] += read_done - labelled
+        seconds["reduce"] += time.perf_counter() - read_done
+
+    if timings is not None:
+        for stage, stage_seconds in seconds.items():
+            timings[stage] = timings.get(stage, 0.0) + stage_seconds
+        timings["bytes_read"] = timings.get("bytes_read", 0) + bytes_read
+
+    results = {}
+    for label in np.flatnonzero(count).tolist():
+        stats = ElevationStats(int(count[label]), float(total[label]), float(total_sq[label]),
+                               float(minimum[label]), float(maximum[label]),
+                               float(area[label]), float(area_total[label]), statistics)
+        if label in pixel_stats:
+            # Only the pixel statistics of this summary are set; the other fields are zero
+            stats.merge(pixel_stats[label])
+        results[keys[label - 1]] = stats
+    return results
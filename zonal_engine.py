@@ -0,0 +1,439 @@
+import multiprocessing
+import os
+import pickle
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from queue import Empty
+
+import shapely
+
+from elevation_stats import ElevationStats, slope_degrees
+from geometry_prep import raster_grid
+from metrics import bbox_pixels
+from mosaic import (DatasetPool, pixel_height, pixel_row_areas, polygon_mask, read_mosaic, tile_window,
+                    valid_data_mask)
+from result_cache import result_key
+from shared_blocks import SharedBlockCache
+from tile_major import compute_tile_stats
+
+# Merge strategies for polygons that span several tiles
+MOSAIC = "mosaic"      # read one mosaic window under the polygon, then mask it
+PER_TILE = "per-tile"  # mask each tile separately and merge the summaries
+TILE_MAJOR = "tile-major"  # read each tile once and label every polygon in it
+STRATEGIES = (MOSAIC, PER_TILE, TILE_MAJOR)
+
+# Tasks queued ahead at each worker, so it never waits on the parent between tasks
+WORKER_BACKLOG = 2
+
+# Per-process state: tile metadata and the pool of open datasets
+_tiles = None
+_datasets = None
+
+
+def _init_worker(tiles, max_open, shared_cache=None):
+    global _tiles, _datasets
+    _tiles = {tile.path: tile for tile in tiles}
+    if shared_cache is not None:
+        directory, max_bytes = shared_cache
+        _datasets = SharedBlockCache(directory, max_bytes, max_open)
+    else:
+        _datasets = DatasetPool(max_open)
+
+
+# Function to add the seconds since ``start`` to a stage of ``timings`` and return the time now
+def _lap(timings, stage, start):
+    now = time.perf_counter()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + now - start
+    return now
+
+
+# Function to compute the slopes of a window when the statistics include them
+def _window_slopes(statistics, data, valid, row_areas, transform, geographic):
+    if statistics is None or not statistics.slope:
+        return None
+    return slope_degrees(data, valid, row_areas, pixel_height(transform, geographic))
+
+
+# Function to compute the summary of one polygon from its intersecting tiles, timing
+# the read, mask and reduce stages into ``timings`` when it is given
+def compute_stats(geometry, tiles, strategy=MOSAIC, datasets=None, timings=None, statistics=None):
+    owns_datasets = datasets is None
+    if owns_datasets:
+        datasets = DatasetPool()
+    try:
+        stats = ElevationStats(statistics=statistics)
+        bytes_read = 0
+        start = time.perf_counter()
+        if strategy == MOSAIC:
+            data, valid, transform = read_mosaic(tiles, geometry.bounds, datasets)
+            bytes_read += data.nbytes
+            start = _lap(timings, "read", start)
+            row_areas = pixel_row_areas(transform, data.shape[0], tiles[0].geographic)
+            # Slopes use the neighbours of boundary pixels, so they come before the polygon mask
+            slopes = _window_slopes(statistics, data, valid, row_areas, transform, tiles[0].geographic)
+            valid &= polygon_mask(geometry, data.shape, transform)
+            start = _lap(timings, "mask", start)
+            stats.add_window(data, valid, row_areas, slope=slopes)
+            _lap(timings, "reduce", start)
+        elif strategy == PER_TILE:
+            for tile in tiles:
+                try:
+                    window, transform = tile_window(tile, geometry.bounds)
+                    if window is None:
+                        continue
+                    data = datasets.read(tile, window)
+                    bytes_read += data.nbytes
+                    start = _lap(timings, "read", start)
+                    # Raster nodata and the polygon are separate masks, so a
+                    # tile without a nodata value never counts outside pixels
+                    valid = valid_data_mask(data, tile.nodata)
+                    row_areas = pixel_row_areas(transform, data.shape[0], tile.geographic)
+                    slopes = _window_slopes(statistics, data, valid, row_areas, transform, tile.geographic)
+                    valid &= polygon_mask(geometry, data.shape, transform)
+                    start = _lap(timings, "mask", start)
+                    stats.add_window(data, valid, row_areas, slope=slopes)
+                    start = _lap(timings, "reduce", start)
+                except Exception as e:
+                    print(f"Warning: Skipping {tile.path} due to error - {e}")
+        else:
+            raise ValueError(f"Unknown strategy {strategy!r}, expected one of {STRATEGIES}")
+        if timings is not None:
+            timings["bytes_read"] = timings.get("bytes_read", 0) + bytes_read
+        return stats
+    finally:
+        if owns_datasets:
+            datasets.close()
+
+
+def _process_chunk(chunk, strategy, measure, statistics=None):
+    results = []
+    for feature_id, wkb, tile_paths, pixels, lookup in chunk:
+        geometry = shapely.from_wkb(wkb)
+        record = None
+        if measure:
+            record = {"kind": "polygon", "key": str(feature_id), "tiles": len(tile_paths), "pixels": pixels,
+                      "lookup": lookup}
+        stats = compute_stats(geometry, [_tiles[path] for path in tile_paths], strategy, _datasets, record,
+                              statistics)
+        results.append((feature_id, stats, pixels, record))
+    return results
+
+
+def _process_tile(tile_path, polygons, claimed_bounds, measure, statistics=None):
+    polygons = [(key, shapely.from_wkb(wkb)) for key, wkb in polygons]
+    src = _datasets.get(tile_path)
+    record = None
+    if measure:
+        record = {"kind": "tile", "key": os.path.basename(tile_path), "polygons": len(polygons)}
+    tile = _tiles[tile_path]
+    results = compute_tile_stats(src, polygons, claimed_bounds, record, statistics,
+                                 read=lambda window: _datasets.read(tile, window))
+    return [key for key, _ in polygons], results, record
+
+
+# Function to run the tasks a worker process is handed, in order, posting each result
+def _worker_loop(worker, func, inbox, outbox, tiles, max_open, shared_cache):
+    _init_worker(tiles, max_open, shared_cache)
+    try:
+        for task in iter(inbox.get, None):
+            try:
+                outbox.put((worker, None, func(*task)))
+            except Exception as e:
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = RuntimeError(f"{type(e).__name__}: {e}")
+                outbox.put((worker, e, None))
+    finally:
+        _datasets.close()
+
+
+# Function to run tasks in the calling process or on a worker pool. Each worker owns a
+# contiguous slice of ``tasks`` (sorted so that neighbours share tiles), which keeps its
+# dataset pool warm. Tasks are handed out lazily, and a worker that runs out of its own
+# takes them from the far end of the longest remaining slice.
+def _imap_unordered(func, tasks, tiles, workers, max_open, shared_cache=None):
+    if workers == 1:
+        _init_worker(tiles, max_open, shared_cache)
+        try:
+            for task in tasks:
+                yield func(*task)
+        finally:
+            _datasets.close()
+            _clear_shared_cache(shared_cache)
+        return
+
+    tasks = list(tasks)
+    if not tasks:
+        _clear_shared_cache(shared_cache)
+        return
+    size = -(-len(tasks) // workers)
+    slices = [deque(tasks[i:i + size]) for i in range(0, len(tasks), size)]
+    outbox = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue() for _ in slices]
+    processes = [multiprocessing.Process(target=_worker_loop, daemon=True,
+                                         args=(worker, func, inbox, outbox, tiles, max_open, shared_cache))
+                 for worker, inbox in enumerate(inboxes)]
+    for process in processes:
+        process.start()
+
+    def feed(worker):
+        own = slices[worker]
+        if own:
+            inboxes[worker].put(own.popleft())
+            return 1
+        longest = max(slices, key=len)
+        if longest:
+            inboxes[worker].put(longest.pop())
+            return 1
+        return 0
+
+    finished = False
+    try:
+        pending = sum(feed(worker) for worker in range(len(slices)) for _ in range(WORKER_BACKLOG))
+        while pending:
+            try:
+                worker, error, result = outbox.get(timeout=1)
+            except Empty:
+                if any(process.exitcode not in (None, 0) for process in processes):
+                    raise RuntimeError("A worker process died unexpectedly") from None
+                continue
+            if error is not None:
+                raise error
+            pending += feed(worker) - 1
+            yield result
+        finished = True
+    finally:
+        for inbox in inboxes:
+            if finished:
+                inbox.put(None)
+            else:
+                # Terminated workers leave their queues unread; don't wait to flush them at exit
+                inbox.cancel_join_thread()
+        for process in processes:
+            if not finished:
+                process.terminate()
+            process.join()
+        _clear_shared_cache(shared_cache)
+
+
+# Function to delete the tiles decoded into the shared block cache once the workers are done with them
+def _clear_shared_cache(shared_cache):
+    if shared_cache is not None:
+        directory, max_bytes = shared_cache
+        SharedBlockCache(directory, max_bytes).clear()
+
+
+# Function to group polygons by the tiles they hit and cut them into work chunks.
+# Each polygon carries its work estimate (bounding box pixels) and tile lookup time.
+def schedule(features, catalog, chunk_size):
+    jobs = []
+    skipped = 0
+    _, pixel_size = raster_grid(catalog)
+    for feature_id, geometry in features:
+        start = time.perf_counter()
+        tiles = catalog.query(geometry.bounds) if geometry is not None and not geometry.is_empty else []
+        lookup = time.perf_counter() - start
+        if not tiles:
+            skipped += 1
+            continue
+        centroid = geometry.centroid
+        item = (feature_id, shapely.to_wkb(geometry), tiles, bbox_pixels(geometry.bounds, pixel_size), lookup)
+        jobs.append(((tuple(tiles), centroid.y, centroid.x), item))
+
+    # Polygons that hit the same tiles end up next to each other, so each
+    # chunk (and the worker that picks it up) touches only a few tiles
+    jobs.sort(key=lambda job: job[0])
+    items = [item for _, item in jobs]
+    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)], skipped
+
+
+# Function to group polygons under every tile they hit, one task per tile. Also returns,
+# per polygon, the number of tiles, work estimate and tile lookup time.
+def schedule_tiles(features, catalog):
+    feature_ids = []
+    remaining = []
+    pixels = []
+    lookups = []
+    by_tile = defaultdict(list)
+    skipped = 0
+    _, pixel_size = raster_grid(catalog)
+    for feature_id, geometry in features:
+        start = time.perf_counter()
+        tiles = catalog.query(geometry.bounds) if geometry is not None and not geometry.is_empty else []
+        lookup = time.perf_counter() - start
+        if not tiles:
+            skipped += 1
+            continue
+        key = len(feature_ids)
+        feature_ids.append(feature_id)
+        remaining.append(len(tiles))
+        pixels.append(bbox_pixels(geometry.bounds, pixel_size))
+        lookups.append(lookup)
+        wkb = shapely.to_wkb(geometry)
+        for tile_path in tiles:
+            by_tile[tile_path].append((key, wkb))
+
+    # Overlapping pixels are counted by the first tile in catalog order
+    order = {tile.path: i for i, tile in enumerate(catalog.tiles)}
+    tasks = [(tile_path, by_tile[tile_path], catalog.claimed_bounds(tile_path))
+             for tile_path in sorted(by_tile, key=order.get)]
+    return tasks, feature_ids, remaining, pixels, lookups, skipped
+
+
+# Function to add a batch of polygons weighing ``work`` pixels to the progress, some already done
+def _extend_progress(progress, scheduled, skipped, work=0):
+    if progress is not None:
+        progress.add(scheduled + skipped, work)
+        progress.advance(skipped)
+
+
+# Function to answer polygons large enough for a pyramid level and pass the rest through
+def _answer_from_pyramid(features, catalog, pyramid, tolerance, on_result, progress):
+    for feature_id, geometry in features:
+        if geometry is not None and not geometry.is_empty:
+            tiles = catalog.query_tiles(geometry.bounds)
+            factor = pyramid.choose_factor(geometry, tiles, tolerance) if tiles else None
+            if factor is not None:
+                stats = pyramid.query(geometry, tiles, factor)
+                if stats is not None:
+                    _extend_progress(progress, 0, 1)
+                    on_result(feature_id, stats)
+                    continue
+        yield feature_id, geometry
+
+
+# Function to answer polygons from the result cache and pass the rest through
+def _skip_cached(features, catalog, strategy, result_cache, cache_keys, on_result, progress):
+    for feature_id, geometry in features:
+        if geometry is not None and not geometry.is_empty:
+            tiles = catalog.query_tiles(geometry.bounds)
+            if tiles:
+                key = result_key(geometry, tiles, strategy)
+                stats = result_cache.get(key)
+                if stats is not None:
+                    _extend_progress(progress, 0, 1)
+                    on_result(feature_id, stats)
+                    continue
+                # Results of a repeated ID cannot be told apart, so they are not cached
+                cache_keys[feature_id] = None if feature_id in cache_keys else key
+        yield feature_id, geometry
+
+
+@dataclass
+class RunOptions:
+    """
+    How ``run_zonal_stats`` computes polygons. Built once per run and passed
+    through unchanged.
+
+    - ``strategy``: one of ``STRATEGIES``.
+    - ``workers``: worker processes (None for all CPU cores).
+    - ``chunk_size``, ``max_open``: polygons per task, open datasets per worker.
+    - ``result_cache``: a ``ResultCache`` that answers polygons whose geometry
+      and tiles are unchanged, and keeps every newly computed summary.
+    - ``pyramid``, ``tolerance``: a ``Pyramid`` that summarises polygons large
+      enough for one of its levels (see ``Pyramid.choose_factor``).
+    - ``metrics``: a ``metrics.MetricsLog`` that records per-polygon stage timings.
+    - ``shared_cache``: ``(directory, max_bytes)`` of a ``SharedBlockCache``
+      the workers read tiles through.
+    - ``statistics``: a ``StatisticSet`` accumulated in the same pass. When it
+      needs the pixels, the result cache and the pyramid are not used.
+    """
+    strategy: str = MOSAIC
+    workers: int = 1
+    chunk_size: int = 64
+    max_open: int = 32
+    result_cache: object = None
+    pyramid: object = None
+    tolerance: float = 0.01
+    metrics: object = None
+    shared_cache: tuple = None
+    statistics: object = None
+
+
+def run_zonal_stats(features, catalog, on_result, options=None, progress=None):
+    """
+    Compute an ``ElevationStats`` summary for every ``(feature_id, geometry)``
+    in ``features`` and hand each one to ``on_result(feature_id, stats)``,
+    as set up by ``options`` (a ``RunOptions``).
+
+    Work is spread over worker processes in chunks of polygons that share
+    tiles (or, for the tile-major strategy, one task per tile); ``on_result``
+    is always called from the calling process. ``progress`` is an optional
+    ``metrics.WorkProgress``, advanced by the pixels under the polygons'
+    bounding boxes as they finish.
+    """
+    options = options or RunOptions()
+    strategy, metrics, statistics = options.strategy, options.metrics, options.statistics
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown strategy {strategy!r}, expected one of {STRATEGIES}")
+    workers = options.workers or os.cpu_count() or 1
+    max_open, shared_cache = options.max_open, options.shared_cache
+    result_cache, pyramid = options.result_cache, options.pyramid
+    if statistics is not None and statistics.needs_pixels:
+        result_cache = pyramid = None
+
+    if pyramid is not None:
+        features = _answer_from_pyramid(features, catalog, pyramid, options.tolerance, on_result, progress)
+
+    if result_cache is not None:
+        cache_keys = {}
+        features = _skip_cached(features, catalog, strategy, result_cache, cache_keys, on_result, progress)
+        emit = on_result
+
+        def on_result(feature_id, stats):
+            key = cache_keys.pop(feature_id, None)
+            if key is not None:
+                result_cache.put(key, stats)
+            emit(feature_id, stats)
+
+    measure = metrics is not None
+
+    if strategy == TILE_MAJOR:
+        tasks, feature_ids, remaining, pixels, lookups, skipped = schedule_tiles(features, catalog)
+        _extend_progress(progress, len(feature_ids), skipped, sum(pixels))
+
+        partial = {}
+        tile_counts = list(remaining)
+        tasks = [task + (measure, statistics) for task in tasks]
+        for keys, results, tile_record in _imap_unordered(_process_tile, tasks, catalog.tiles, workers,
+                                                          max_open, shared_cache):
+            if measure:
+                metrics.record(tile_record)
+            for key, stats in results.items():
+                if key in partial:
+                    partial[key].merge(stats)
+                else:
+                    partial[key] = stats
+
+            # A polygon is finished once every tile it touches has reported
+            for key in keys:
+                remaining[key] -= 1
+                if remaining[key] == 0:
+                    start = time.perf_counter()
+                    on_result(feature_ids[key], partial.pop(key, ElevationStats(statistics=statistics)))
+                    if measure:
+                        metrics.record({"kind": "polygon", "key": str(feature_ids[key]),
+                                        "tiles": tile_counts[key],
+                                        "pixels": pixels[key], "lookup": lookups[key],
+                                        "output": time.perf_counter() - start})
+                    if progress is not None:
+                        progress.advance(1, pixels[key])
+        return
+
+    chunks, skipped = schedule(features, catalog, options.chunk_size)
+    _extend_progress(progress, sum(len(chunk) for chunk in chunks), skipped,
+                     sum(item[3] for chunk in chunks for item in chunk))
+
+    tasks = [(chunk, strategy, measure, statistics) for chunk in chunks]
+    for results in _imap_unordered(_process_chunk, tasks, catalog.tiles, workers, max_open, shared_cache):
+        for feature_id, stats, _, record in results:
+            start = time.perf_counter()
+            on_result(feature_id, stats)
+            if measure:
+                record["output"] = time.perf_counter() - start
+                metrics.record(record)
+        if progress is not None:
+            progress.advance(len(results), sum(pixels for _, _, pixels, _ in results))
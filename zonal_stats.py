@@ -0,0 +1,337 @@
+"""
+Zonal elevation statistics for ZIP codes (ZCTAs), counties, census tracts or
+any polygon layer.
+
+Usable as a library::
+
+    from zonal_stats import compute_zonal_stats
+    stats = compute_zonal_stats(gdf, "GEOID", "elevation_tiles")
+
+or from the command line::
+
+    python zonal_stats.py zcta
+    python zonal_stats.py tract --workers 16 --strategy tile-major
+    python zonal_stats.py my_regions.shp --id-column REGION_ID --output regions.csv
+    python zonal_stats.py tract --format parquet
+    python zonal_stats.py zcta --metrics zcta_metrics.jsonl --slowest 20
+    python zonal_stats.py county --stats min,max,std,median,p90,above:1500,slope
+"""
+import argparse
+import os
+
+import numpy as np
+import shapely
+
+from checkpoint_store import CheckpointStore
+from elevation_stats import ElevationStats, StatisticSet
+from geometry_prep import describe_simplification, prepare_polygons, raster_grid
+from metrics import MetricsLog, WorkProgress
+from polygon_dataset import iter_partitions
+from pyramid import Pyramid
+from result_cache import ResultCache, tile_identity
+from table_io import first_existing, is_parquet
+from tile_cache import LinkIndex, TileCache
+from tile_catalog import TileCatalog
+from tile_downloader import read_links
+from zonal_engine import MOSAIC, PER_TILE, STRATEGIES, TILE_MAJOR, RunOptions, run_zonal_stats
+
+# Get the directory where the script is located
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# Built-in geographies and the defaults of the scripts they replace
+GEOGRAPHIES = {
+    "zcta": {
+        "paths": ["tl_2024_us_zcta520.shp"],
+        "id_column": "ZCTA5CE20",
+        "id_header": "ZIP Code",
+        "output": "zip_code_elevations.csv",
+        "strategy": MOSAIC,
+        "desc": "Processing ZIP Codes",
+    },
+    "county": {
+        "paths": ["tl_2024_us_county.shp"],
+        "id_column": "GEOID",
+        "id_header": "County FIPS",
+        "output": "county_elevations.csv",
+        "strategy": MOSAIC,
+        "desc": "Processing Counties",
+    },
+    "tract": {
+        # State-partitioned GeoParquet dataset written by dl_tracts.py, or a merged Shapefile
+        "paths": ["tl_2024_us_tract.parquet", "tl_2024_us_tract.shp"],
+        "id_column": "GEOID",
+        "id_header": "Tract ID",
+        "output": "tract_elevations.csv",
+        "strategy": PER_TILE,
+        "desc": "Processing Census Tracts",
+    },
+}
+
+
+# Function to pair each polygon's ID with its geometry
+def iter_features(polygons, id_column):
+    yield from zip(polygons[id_column], polygons.geometry)
+
+
+# Function to list the tiles a polygon touches, as {tile name: version}
+def polygon_tiles(geometry, catalog):
+    if geometry is None or geometry.is_empty:
+        return {}
+    return {tile.name: tile_identity(tile) for tile in catalog.query_tiles(geometry.bounds)}
+
+
+# Function to decide which finished polygons of a partition an update of the tiles invalidates.
+# Results from before the dependency map existed are assumed current and backfilled into it.
+def find_outdated(polygons, id_column, store, catalog, crs, stale, added, up_to_date, backfill):
+    ids = polygons[id_column].astype(str)
+    outdated = set(ids[ids.isin(stale)])
+    if added or backfill:
+        finished, _ = prepare_polygons(polygons, crs, None)
+        for feature_id, geometry in zip(ids, finished.geometry):
+            tiles = polygon_tiles(geometry, catalog)
+            if backfill:
+                store.put_tiles(feature_id, tiles)
+            elif feature_id not in up_to_date and not added.keys().isdisjoint(tiles):
+                outdated.add(feature_id)
+    return outdated
+
+
+def compute_zonal_stats(polygons, id_column, elevation_dir, options=None, catalog=None):
+    """
+    Compute an ``ElevationStats`` summary for every polygon of the
+    GeoDataFrame ``polygons`` and return them as ``{id: stats}``, computed
+    as set up by ``options`` (a ``zonal_engine.RunOptions``).
+
+    Polygons that do not touch any elevation tile are left out. With
+    ``options.statistics``, read the extra statistics of a summary with
+    ``options.statistics.values(stats)``.
+    """
+    catalog = catalog or TileCatalog.load(elevation_dir)
+    results = {}
+
+    def collect(feature_id, stats):
+        if stats:
+            results[feature_id] = stats
+
+    run_zonal_stats(iter_features(polygons, id_column), catalog, collect, options)
+    return results
+
+
+# Function to run the engine over tiles fetched on demand into a TileCache
+def run_with_tile_cache(features, tile_cache, on_result, options=None, progress=None):
+    for batch, urls in tile_cache.plan(features):
+        failed = tile_cache.ensure(urls)
+        if failed:
+            # Leave polygons on unavailable tiles unstored, so a later run retries them
+            batch = [(feature_id, geometry) for feature_id, geometry in batch
+                     if geometry is None or geometry.is_empty
+                     or failed.isdisjoint(tile_cache.link_index.query(geometry.bounds))]
+        catalog = TileCatalog.load(tile_cache.cache_dir)
+        run_zonal_stats(batch, catalog, on_result, options, progress)
+
+
+# Function to compute every polygon in ``polygons_path`` as set up by ``options`` (a ``RunOptions``)
+# and write the results to ``output_path`` (Parquet for a .parquet extension, CSV otherwise).
+# Finished polygons are journaled in a checkpoint store next to the output, and only those
+# whose tiles changed since are recomputed. With a ``TileCache``, tiles are downloaded on demand.
+def write_zonal_stats(polygons_path, id_column, output_path, elevation_dir, options=None, id_header=None,
+                      desc="Processing Polygons", checkpoint_path=None, tile_cache=None, simplify_pixels=None):
+    options = options or RunOptions()
+    with CheckpointStore(checkpoint_path or CheckpointStore.default_path(output_path),
+                         statistics=options.statistics) as store:
+        # Carry over results from a CSV written before the checkpoint store existed
+        if len(store) == 0 and os.path.exists(output_path) and not is_parquet(output_path):
+            store.import_csv(output_path)
+        completed = store.completed_ids()
+        catalog = TileCatalog.load(elevation_dir) if tile_cache is None else None
+        crs, pixel_size = raster_grid(catalog)
+        if tile_cache is not None:
+            # Polygons are matched to tiles to download by their longitude/latitude bounds
+            crs = tile_cache.crs
+        vertices_before, vertices_after, errors = 0, 0, []
+
+        # Compare the tiles with those the stored results were computed from
+        versions, stale, added, up_to_date, backfill = {}, set(), {}, set(), False
+        on_result = store.put
+        if catalog is not None:
+            versions = {tile.name: tile_identity(tile) for tile in catalog}
+            previous = store.tile_set()
+            backfill = bool(completed) and not previous
+            if not backfill:
+                stale = store.stale_ids(versions)
+                added = {name: version for name, version in versions.items() if name not in previous}
+                up_to_date = store.dependent_ids(added)
+            pending_tiles = {}
+            recomputing = set()
+
+            # Record the tiles of every polygon handed to the engine, and store them with its result.
+            # A recomputed polygon whose tiles were all removed gets no result from the engine, so its
+            # stale row is replaced with an empty one here.
+            def track(features):
+                for feature_id, geometry in features:
+                    tiles = polygon_tiles(geometry, catalog)
+                    if tiles:
+                        pending_tiles[feature_id] = tiles
+                    elif str(feature_id) in recomputing:
+                        store.put(feature_id, ElevationStats(), {})
+                    yield feature_id, geometry
+
+            def on_result(feature_id, stats):
+                store.put(feature_id, stats, pending_tiles.pop(feature_id, None))
+
+        try:
+            with WorkProgress(desc) as progress:
+                for polygons in iter_partitions(polygons_path, columns=[id_column]):
+                    finished = polygons[id_column].astype(str).isin(completed)
+                    if catalog is not None and finished.any():
+                        outdated = find_outdated(polygons[finished], id_column, store, catalog, crs, stale,
+                                                 added, up_to_date, backfill)
+                        if outdated:
+                            print(f"Recomputing {len(outdated)} polygons whose tiles changed")
+                            finished &= ~polygons[id_column].astype(str).isin(outdated)
+                            recomputing |= outdated
+                    polygons = polygons[~finished]
+                    if simplify_pixels:
+                        vertices_before += int(shapely.get_num_coordinates(polygons.geometry.to_numpy()).sum())
+                    # Tile-major gives each pixel to one polygon, so neighbours must not overlap after simplifying
+                    polygons, error = prepare_polygons(polygons, crs, pixel_size, simplify_pixels,
+                                                       coverage=options.strategy == TILE_MAJOR)
+                    if simplify_pixels:
+                        vertices_after += int(shapely.get_num_coordinates(polygons.geometry.to_numpy()).sum())
+                        errors.append(error)
+
+                    features = iter_features(polygons, id_column)
+                    if tile_cache is not None:
+                        run_with_tile_cache(features, tile_cache, store.put, options, progress)
+                    else:
+                        run_zonal_stats(track(features), catalog, on_result, options, progress)
+            # Every polygon is now up to date with these tiles
+            if catalog is not None:
+                store.save_tile_set(versions)
+        finally:
+            store.export(output_path, id_header or id_column)
+            if simplify_pixels:
+                print(describe_simplification(vertices_before, vertices_after, np.concatenate(errors or [[]])))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute the average elevation of every polygon in a layer.")
+    parser.add_argument("geography",
+                        help=f"One of {', '.join(GEOGRAPHIES)} or the path to any polygon layer")
+    parser.add_argument("--id-column", help="Column holding the polygon IDs")
+    parser.add_argument("--output", help="Output path; a .parquet extension writes Parquet instead of CSV")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv",
+                        help="Format of the default output file (default: csv)")
+    parser.add_argument("--elevation-dir", default=os.path.join(script_dir, "elevation_tiles"),
+                        help="Directory of elevation GeoTIFF tiles")
+    parser.add_argument("--strategy", choices=STRATEGIES,
+                        help="How to combine tiles for polygons that span several of them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all CPU cores)")
+    parser.add_argument("--tile-links",
+                        help="Fetch only the tiles the polygons need from this links file (e.g. tif_links.txt), "
+                             "caching them in --elevation-dir")
+    parser.add_argument("--cache-size-gb", type=float, default=50,
+                        help="Size cap of the on-demand tile cache (default: 50)")
+    parser.add_argument("--result-cache",
+                        help="Cache of polygon results keyed by geometry and tiles "
+                             "(default: <elevation-dir>_results.sqlite)")
+    parser.add_argument("--no-result-cache", action="store_true",
+                        help="Recompute every polygon instead of reusing cached results")
+    parser.add_argument("--pyramid-tolerance", type=float,
+                        help="Summarise polygons from the reduced-resolution pyramid (built with pyramid.py) "
+                             "when its boundary blocks make up at most this share of the polygon, e.g. 0.01")
+    parser.add_argument("--pyramid-dir", help="Pyramid directory (default: <elevation-dir>_pyramid)")
+    parser.add_argument("--simplify-pixels", type=float,
+                        help="Simplify polygons to this many pixels (e.g. 0.5) before computing, "
+                             "and report the resulting error bound. Each polygon is simplified on its own, "
+                             "so neighbours may overlap; with --strategy tile-major the layer is simplified "
+                             "as a coverage instead, which needs shapely 2.1 and non-overlapping polygons")
+    parser.add_argument("--shared-cache-gb", type=float,
+                        help="Decompress each tile block once into a cache of this size shared by all workers "
+                             "(in /dev/shm where available), instead of once per polygon")
+    parser.add_argument("--shared-cache-dir", help="Directory of the shared block cache")
+    parser.add_argument("--stats",
+                        help="Extra statistics to compute in the same pass, comma-separated: min, max, std, "
+                             "median, pNN (e.g. p90), above:<metres> (share of area above) and slope "
+                             "(mean, in degrees)")
+    parser.add_argument("--histogram-bin-m", type=float, default=1.0,
+                        help="Width in metres of the histogram bins percentiles are interpolated from "
+                             "(default: 1)")
+    parser.add_argument("--metrics",
+                        help="Write per-polygon stage timings, bytes read and tiles touched to this file: "
+                             "JSON lines, or a Prometheus text file with a .prom extension")
+    parser.add_argument("--slowest", type=int, default=10,
+                        help="Number of slowest polygons to report at the end of the run (default: 10)")
+    args = parser.parse_args(argv)
+
+    statistics = None
+    if args.stats:
+        try:
+            statistics = StatisticSet.parse(args.stats, args.histogram_bin_m)
+        except ValueError as e:
+            parser.error(str(e))
+
+    defaults = GEOGRAPHIES.get(args.geography)
+    if defaults is not None:
+        polygons_path = first_existing(*[os.path.join(script_dir, path) for path in defaults["paths"]])
+    else:
+        if not args.id_column:
+            parser.error("--id-column is required for custom polygon layers")
+        polygons_path = args.geography
+        stem = os.path.splitext(os.path.basename(polygons_path))[0]
+        defaults = {
+            "id_column": args.id_column,
+            "id_header": args.id_column,
+            "output": f"{stem}_elevations.csv",
+            "strategy": MOSAIC,
+            "desc": "Processing Polygons",
+        }
+
+    tile_cache = None
+    if args.tile_links:
+        link_index = LinkIndex(read_links(args.tile_links))
+        tile_cache = TileCache(args.elevation_dir, link_index, args.cache_size_gb * 1e9)
+
+    result_cache = None
+    if not args.no_result_cache:
+        result_cache = ResultCache(args.result_cache or ResultCache.default_path(args.elevation_dir))
+
+    pyramid = None
+    if args.pyramid_tolerance is not None:
+        pyramid = Pyramid(args.pyramid_dir or Pyramid.default_path(args.elevation_dir))
+
+    metrics = MetricsLog(args.metrics, args.slowest)
+    options = RunOptions(
+        strategy=args.strategy or defaults["strategy"],
+        workers=args.workers,
+        result_cache=result_cache,
+        pyramid=pyramid,
+        tolerance=args.pyramid_tolerance,
+        metrics=metrics,
+        shared_cache=(args.shared_cache_dir, args.shared_cache_gb * 2 ** 30) if args.shared_cache_gb else None,
+        statistics=statistics,
+    )
+    if args.simplify_pixels and options.strategy == TILE_MAJOR and not hasattr(shapely, "coverage_simplify"):
+        parser.error("--simplify-pixels with --strategy tile-major needs shapely 2.1 or later")
+    try:
+        write_zonal_stats(
+            polygons_path,
+            args.id_column or defaults["id_column"],
+            args.output or os.path.join(script_dir, os.path.splitext(defaults["output"])[0] + "." + args.format),
+            args.elevation_dir,
+            options,
+            id_header=defaults["id_header"],
+            desc=defaults["desc"],
+            tile_cache=tile_cache,
+            simplify_pixels=args.simplify_pixels,
+        )
+    finally:
+        metrics.close()
+        print(metrics.report())
+        if result_cache is not None:
+            result_cache.close()
+
+
+if __name__ == "__main__":
+    main()